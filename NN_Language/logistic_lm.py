@@ -5,7 +5,6 @@ from builtins import range, input
 
 import numpy as np
 import matplotlib.pyplot as plt
-import random
 from datetime import datetime
 
 import os
@@ -19,7 +18,7 @@ from markov_lm import get_bigram_probs
 
 
 if __name__ == '__main__':
-    sentences, word2idx = get_sentences_with_word2idx_limit_vocab(2000)
+    sentences, word2idx = get_sentences_with_word2idx_limit_vocab(2000, flat=True, use_cache=True)
     V = len(word2idx)
 
     print("Vocab size: ", V)
@@ -46,11 +45,11 @@ if __name__ == '__main__':
     t0 = datetime.now()
 
     for epoch in range(epochs):
-        random.shuffle(sentences)
+        order = np.random.permutation(len(sentences))
 
         j= 0
-        for sentence in sentences:
-            senetence = [start_idx] + sentence + [end_idx]
+        for i in order:
+            sentence = sentences[i]
             n = len(sentence)
             inputs = np.zeros((n-1, V))
             targets = np.zeros((n-1, V))
@@ -10,10 +10,18 @@ import sys
 
 sys.path.append(os.path.abspath('..'))
 from nlp_util import get_sentences_with_word2idx_limit_vocab, get_sentences_with_word2idx
+from flat_corpus import FlatCorpus
+from vocab import Vocab
 
 def get_bigram_probs(sentences, V, start_idx, end_idx, smoothing=1):
 
     bigram_probs = np.ones((V, V)) * smoothing
+
+    if isinstance(sentences, FlatCorpus):
+        add_flat_bigram_counts(bigram_probs, sentences, start_idx, end_idx)
+        bigram_probs /= bigram_probs.sum(axis=1, keepdims=True)
+        return bigram_probs
+
     for sentence in sentences:
         for i in range(len(sentence)):
 
@@ -28,8 +36,32 @@ def get_bigram_probs(sentences, V, start_idx, end_idx, smoothing=1):
     bigram_probs /= bigram_probs.sum(axis=1, keepdims=True)
     return bigram_probs
 
+def add_flat_bigram_counts(bigram_counts, corpus, start_idx, end_idx, block_size=10000000):
+    # same counts as the loop above, computed on the flat token array one
+    # block of token positions at a time so a mmap'd corpus is never copied whole
+    tokens, offsets = corpus.tokens, corpus.offsets
+    lengths = np.diff(offsets)
+    starts = offsets[:-1][lengths > 0]
+    ends = offsets[1:][lengths > 0] - 1
+
+    for b in range(0, len(starts), block_size):
+        np.add.at(bigram_counts, (start_idx, tokens[starts[b:b+block_size]]), 1)
+        np.add.at(bigram_counts, (tokens[ends[b:b+block_size]], end_idx), 1)
+
+    # a pair (p, p+1) is inside a sentence unless p is the last token of one
+    n_pairs = len(tokens) - 1
+    for a in range(0, n_pairs, block_size):
+        b = min(a + block_size, n_pairs)
+        prev = np.asarray(tokens[a:b])
+        nxt = np.asarray(tokens[a+1:b+1])
+        inside = np.ones(b - a, dtype=bool)
+        lo, hi = np.searchsorted(ends, [a, b])
+        inside[ends[lo:hi] - a] = False
+        np.add.at(bigram_counts, (prev[inside], nxt[inside]), 1)
+
+
 if __name__ =='__main__':
-    sentences, word2idx = get_sentences_with_word2idx_limit_vocab(10000)
+    sentences, word2idx = get_sentences_with_word2idx_limit_vocab(10000, flat=True, use_cache=True)
 
     V = len(word2idx)
     print("Vocab size: ", V)
@@ -50,10 +82,10 @@ if __name__ =='__main__':
 
         return score /(len(sentence) + 1)
 
-    idx2word = dict((v, k) for k, v in iteritems(word2idx))
+    vocab = Vocab.from_word2idx(word2idx).freeze()
 
     def get_words(sentence):
-        return ' '.join(idx2word[i] for i in sentence)
+        return ' '.join(vocab.word(i) for i in sentence)
 
     sample_probs = np.ones(V)
     sample_probs[start_idx] = 0
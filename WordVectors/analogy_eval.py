@@ -0,0 +1,132 @@
+from __future__ import print_function, division
+from builtins import range
+
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from similarity_index import SimilarityIndex, select_top_k
+from embedding_store import load_glove
+
+# Batched evaluation of an analogy questions file, in the standard format
+# (e.g. questions-words.txt from the word2vec release):
+#   : capital-common-countries
+#   Athens Greece Baghdad Iraq
+# "a b c d" means a is to b as c is to d, d is predicted from a, b and c.
+
+ANALOGY_FILE = '../large_files/questions-words.txt'
+
+
+def read_analogy_questions(path, word2idx, lowercase=True):
+    # returns the section names, a (Q, 4) int array of word indices, the
+    # section of every question and the number of questions per section
+    # (including the ones skipped because a word is out of vocabulary)
+    sections = []
+    questions = []
+    question_sections = []
+    totals = []
+    for line in open(path, encoding='utf-8'):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(':'):
+            sections.append(line[1:].strip())
+            totals.append(0)
+            continue
+        if not sections:
+            sections.append('default')
+            totals.append(0)
+        words = line.lower().split() if lowercase else line.split()
+        if len(words) != 4:
+            continue
+        totals[-1] += 1
+        idxs = [word2idx.get(w) for w in words]
+        if any(i is None for i in idxs):
+            continue
+        questions.append(idxs)
+        question_sections.append(len(sections) - 1)
+
+    questions = np.array(questions, dtype=np.int64).reshape(-1, 4)
+    return sections, questions, np.array(question_sections, dtype=np.int64), np.array(totals)
+
+
+def predict_analogies(index, questions, method='add', max_block_bytes=256 * 1024 * 1024):
+    # predicts d for every (a, b, c, d) row, in blocks of questions that keep
+    # the (block, V) working arrays under max_block_bytes: 16 bytes per score
+    # for both methods (the float32 scores plus the float32 temporaries of
+    # 3CosMul, or the negated float32 copy and int64 argpartition of select_top_k).
+    #   add: 3CosAdd, argmax cos(x, b) - cos(x, a) + cos(x, c)
+    #   mul: 3CosMul (Levy & Goldberg 2014), argmax cos'(x, b) cos'(x, c) / (cos'(x, a) + eps)
+    #        with cos' = (cos + 1) / 2 so every term is positive
+    W = index.normed
+    V = index.V
+    block_size = max(1, int(max_block_bytes // (V * 16)))
+
+    predictions = np.zeros(len(questions), dtype=np.int64)
+    for start in range(0, len(questions), block_size):
+        block = questions[start:start+block_size]
+        a, b, c = W[block[:, 0]], W[block[:, 1]], W[block[:, 2]]
+
+        if method == 'add':
+            scores = (b - a + c).dot(W.T)
+        elif method == 'mul':
+            scores = (a.dot(W.T) + 1) / 2
+            scores += 1e-3
+            np.reciprocal(scores, out=scores)
+            scores *= (b.dot(W.T) + 1) / 2
+            scores *= (c.dot(W.T) + 1) / 2
+        else:
+            raise ValueError("unknown method: %s" % method)
+
+        np.put_along_axis(scores, block[:, :3], -np.inf, axis=1)
+        idx, _ = select_top_k(scores, 1)
+        predictions[start:start+block_size] = idx[:, 0]
+    return predictions
+
+
+def evaluate_analogies(embedding, word2idx, path=ANALOGY_FILE, method='add', lowercase=True,
+                       restrict_vocab=None, max_block_bytes=256 * 1024 * 1024, index=None):
+    # restrict_vocab=N only uses the first N rows (the most frequent words for
+    # GloVe and word2vec files), like gensim's evaluate_word_analogies.
+    # returns {section: (correct, seen, total)} and prints a report
+    if restrict_vocab is not None:
+        embedding = embedding[:restrict_vocab]
+        word2idx = dict((w, i) for w, i in word2idx.items() if i < restrict_vocab)
+    if index is None:
+        index = SimilarityIndex(embedding)
+
+    sections, questions, question_sections, totals = read_analogy_questions(path, word2idx, lowercase)
+
+    t0 = datetime.now()
+    predictions = predict_analogies(index, questions, method, max_block_bytes)
+    elapsed = (datetime.now() - t0).total_seconds()
+
+    correct = predictions == questions[:, 3]
+    n_correct = np.bincount(question_sections, weights=correct, minlength=len(sections))
+    n_seen = np.bincount(question_sections, minlength=len(sections))
+
+    results = {}
+    print("method: 3Cos%s" % method.capitalize())
+    for s, name in enumerate(sections):
+        results[name] = (int(n_correct[s]), int(n_seen[s]), int(totals[s]))
+        acc = n_correct[s] / n_seen[s] if n_seen[s] else 0
+        print("%-30s %.4f  (%d / %d, %d skipped)" % (name, acc, n_correct[s], n_seen[s], totals[s] - n_seen[s]))
+
+    print("total accuracy: %.4f (%d / %d, %d skipped)" % (
+        correct.mean() if len(correct) else 0, correct.sum(), len(correct), totals.sum() - len(correct)))
+    print("%d questions in %.2fs, %.0f questions/s" % (len(questions), elapsed, len(questions) / max(elapsed, 1e-9)))
+    return results
+
+
+if __name__ == '__main__':
+    # usage: python analogy_eval.py [questions file] [glove txt file]
+    path = sys.argv[1] if len(sys.argv) > 1 else ANALOGY_FILE
+    glove = sys.argv[2] if len(sys.argv) > 2 else '../large_files/glove.6b/glove.6b.50d.txt'
+
+    print("Loading word vectors...")
+    embedding, vocab = load_glove(glove)
+    word2idx = vocab.word2idx
+    index = SimilarityIndex(embedding)
+    for method in ('add', 'mul'):
+        evaluate_analogies(embedding, word2idx, path, method, index=index)
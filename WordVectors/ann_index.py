@@ -0,0 +1,215 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from similarity_index import SimilarityIndex, select_top_k
+
+# Approximate nearest neighbors for word vectors: an inverted file (IVF) over
+# a coarse k-means of the unit-normalized vectors, with the residual of every
+# vector (x - its centroid) product-quantized into M one-byte codes.
+#
+# For a unit query q, cos(q, x) = q.c + q.r, and with PQ q.r is the sum of M
+# lookups in a (M, 256) table computed once per query. A search scores only
+# the vectors of the nprobe lists closest to q: nprobe trades recall for speed.
+
+
+def assign_nearest(X, centroids, block_rows=16384):
+    # index of the nearest centroid (euclidean) for every row of X
+    c_sq = (centroids ** 2).sum(axis=1)
+    assign = np.zeros(len(X), dtype=np.int64)
+    for start in range(0, len(X), block_rows):
+        block = np.asarray(X[start:start+block_rows], dtype=np.float32)
+        assign[start:start+block_rows] = (2 * block.dot(centroids.T) - c_sq).argmax(axis=1)
+    return assign
+
+
+def kmeans(X, k, n_iter=20, seed=0):
+    # plain Lloyd iterations, every step is a blocked matmul plus a
+    # sort + reduceat for the new centroids. empty clusters are re-seeded
+    rng = np.random.RandomState(seed)
+    X = np.asarray(X, dtype=np.float32)
+    centroids = X[rng.choice(len(X), k, replace=False)].copy()
+    for it in range(n_iter):
+        assign = assign_nearest(X, centroids)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        centroids[nonempty] = np.add.reduceat(X[order], starts, axis=0) / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = X[rng.choice(len(X), len(empty), replace=False)]
+    return centroids
+
+
+def default_n_subquantizers(D):
+    # about 4 dimensions per code byte, M has to divide D
+    m = max(1, D // 4)
+    while D % m:
+        m -= 1
+    return m
+
+
+def normalize_rows(X):
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return X / norms
+
+
+class IVFPQIndex:
+    def __init__(self, centroids, codebooks, list_offsets, ids, codes):
+        self.centroids = centroids        # (n_lists, D)
+        self.codebooks = codebooks        # (M, 256, D / M)
+        self.list_offsets = list_offsets  # (n_lists + 1,) into ids / codes
+        self.ids = ids                    # (V,) vector ids, grouped by list
+        self.codes = codes                # (V, M) uint8
+        self.n_lists, self.D = centroids.shape
+        self.M = codebooks.shape[0]
+
+    @classmethod
+    def build(cls, embedding, n_lists=None, M=None, n_train=None, n_iter=20, block_rows=65536, seed=0):
+        V, D = embedding.shape
+        n_lists = n_lists or max(1, int(4 * np.sqrt(V)))
+        M = M or default_n_subquantizers(D)
+        if D % M:
+            raise ValueError("M=%d must divide D=%d" % (M, D))
+        dsub = D // M
+        rng = np.random.RandomState(seed)
+
+        t0 = datetime.now()
+        n_train = min(V, n_train or max(50 * n_lists, 256 * 40))
+        train = normalize_rows(embedding[np.sort(rng.choice(V, n_train, replace=False))])
+        centroids = kmeans(train, n_lists, n_iter, seed)
+        print("coarse k-means: %d lists in %s" % (n_lists, datetime.now() - t0))
+
+        t0 = datetime.now()
+        residuals = train - centroids[assign_nearest(train, centroids)]
+        ksub = min(256, n_train)
+        codebooks = np.zeros((M, 256, dsub), dtype=np.float32)
+        for m in range(M):
+            codebooks[m, :ksub] = kmeans(residuals[:, m*dsub:(m+1)*dsub], ksub, n_iter, seed + m)
+        print("PQ codebooks: %d x 256 in %s" % (M, datetime.now() - t0))
+
+        t0 = datetime.now()
+        assign = np.zeros(V, dtype=np.int64)
+        codes = np.zeros((V, M), dtype=np.uint8)
+        for start in range(0, V, block_rows):
+            block = normalize_rows(embedding[start:start+block_rows])
+            a = assign_nearest(block, centroids)
+            assign[start:start+block_rows] = a
+            residual = block - centroids[a]
+            for m in range(M):
+                codes[start:start+block_rows, m] = assign_nearest(residual[:, m*dsub:(m+1)*dsub], codebooks[m, :ksub])
+        ids = np.argsort(assign, kind='stable')
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=list_offsets[1:])
+        print("encoded %d vectors in %s" % (V, datetime.now() - t0))
+        return cls(centroids, codebooks, list_offsets, ids, codes[ids])
+
+    def search(self, v, k=10, nprobe=8, exclude=(), rerank=None, n_candidates=None):
+        # returns (indices, approximate cosine scores), best first.
+        # rerank: optional float32 (V, D) matrix; the n_candidates (default
+        # 4k) best PQ hits are re-scored exactly with it
+        q = np.asarray(v, dtype=np.float32)
+        q = q / max(np.linalg.norm(q), 1e-30)
+
+        coarse = self.centroids.dot(q)
+        probe, _ = select_top_k(coarse, nprobe)
+        lut = np.einsum('mjd,md->mj', self.codebooks, q.reshape(self.M, -1))
+
+        starts = self.list_offsets[probe]
+        sizes = self.list_offsets[probe + 1] - starts
+        pos = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        codes = np.asarray(self.codes[pos], dtype=np.int64)
+        scores = np.repeat(coarse[probe], sizes)
+        scores += lut.ravel()[codes + 256 * np.arange(self.M)].sum(axis=1)
+        ids = np.asarray(self.ids[pos])
+
+        exclude = list(exclude)
+        if exclude:
+            scores[np.isin(ids, exclude)] = -np.inf
+
+        n = k if rerank is None else (n_candidates or 4 * k)
+        top, top_scores = select_top_k(scores, n)
+        top = top[np.isfinite(top_scores)]
+        ids = ids[top]
+        if rerank is None:
+            return ids, scores[top]
+
+        order = np.argsort(ids)
+        ids = ids[order]
+        rows = np.asarray(rerank[ids], dtype=np.float32)
+        exact = rows.dot(q) / np.maximum(np.linalg.norm(rows, axis=1), 1e-30)
+        best, best_scores = select_top_k(exact, k)
+        return ids[best], best_scores
+
+    def save(self, prefix):
+        for name in ('centroids', 'codebooks', 'list_offsets', 'ids', 'codes'):
+            np.save('%s_ivfpq_%s.npy' % (prefix, name), getattr(self, name))
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        # the small arrays are read, ids and codes are memory-mapped
+        return cls(
+            np.load('%s_ivfpq_centroids.npy' % prefix),
+            np.load('%s_ivfpq_codebooks.npy' % prefix),
+            np.load('%s_ivfpq_list_offsets.npy' % prefix),
+            np.load('%s_ivfpq_ids.npy' % prefix, mmap_mode=mmap_mode),
+            np.load('%s_ivfpq_codes.npy' % prefix, mmap_mode=mmap_mode),
+        )
+
+
+def benchmark(index, embedding, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32, 64), rerank=False):
+    # recall@k and latency of every nprobe against the brute-force scan
+    # (SimilarityIndex, i.e. nearest_neighbors / most_similar)
+    exact = SimilarityIndex(embedding)
+    t0 = datetime.now()
+    truth = [exact.nearest_neighbors(q, k)[0] for q in queries]
+    brute_ms = (datetime.now() - t0).total_seconds() * 1000 / len(queries)
+
+    print("%-12s %10s %12s" % ('nprobe', 'recall@%d' % k, 'ms/query'))
+    print("%-12s %10.4f %12.3f" % ('brute force', 1.0, brute_ms))
+    results = {}
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        t0 = datetime.now()
+        found = [index.search(embedding[q], k, nprobe, exclude=[q], rerank=embedding if rerank else None)[0] for q in queries]
+        ms = (datetime.now() - t0).total_seconds() * 1000 / len(queries)
+        recall = np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+        results[nprobe] = (recall, ms)
+        print("%-12s %10.4f %12.3f" % (nprobe, recall, ms))
+    return results
+
+
+if __name__ == '__main__':
+    # usage: python ann_index.py [glove txt or word2vec bin] [n queries]
+    path = sys.argv[1] if len(sys.argv) > 1 else '../large_files/glove.6b/glove.6b.50d.txt'
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print("Loading word vectors...")
+    if path.endswith('.bin'):
+        from gensim.models import KeyedVectors
+        embedding = KeyedVectors.load_word2vec_format(path, binary=True).vectors
+    else:
+        from embedding_store import load_glove
+        embedding, _ = load_glove(path)
+
+    prefix = os.path.splitext(path)[0]
+    if os.path.exists('%s_ivfpq_codes.npy' % prefix):
+        index = IVFPQIndex.load(prefix)
+    else:
+        index = IVFPQIndex.build(embedding)
+        index.save(prefix)
+
+    np.random.seed(0)
+    queries = np.random.choice(min(100000, len(embedding)), n_queries, replace=False)
+    for rerank in (False, True):
+        print("re-rank:", rerank)
+        benchmark(index, embedding, queries, rerank=rerank)
@@ -0,0 +1,67 @@
+from __future__ import print_function, division
+from builtins import range
+
+import sys
+import random
+from datetime import datetime
+
+import numpy as np
+
+from nlp_util import my_tokenizer, batch_tokenize, batch_tokenize_ids
+
+# micro-benchmark: my_tokenizer + a dict lookup per token (what the wiki
+# reader used to do) against batch_tokenize_ids on the same lines.
+# usage: python bench_tokenizer.py [wiki file]
+
+
+def get_lines(n_lines=200000):
+    if len(sys.argv) > 1:
+        lines = []
+        for line in open(sys.argv[1], encoding='utf-8'):
+            lines.extend(line.strip().split('. '))
+        return lines[:n_lines]
+
+    random.seed(0)
+    words = ['The', 'king', 'man', 'Queen', 'woman,', 'Paris', 'of', 'and', '(1984)', 'to', 'a', "didn't", 'U.S.', 'is']
+    words += ['word%d' % i for i in range(5000)]
+    return [' '.join(random.choice(words) for _ in range(random.randint(3, 30))) for _ in range(n_lines)]
+
+
+def old_tokenize_ids(lines, word2idx):
+    sentences = []
+    for line in lines:
+        tokens = my_tokenizer(line)
+        for t in tokens:
+            if t not in word2idx:
+                word2idx[t] = len(word2idx)
+        sentences.append([word2idx[t] for t in tokens])
+    return sentences
+
+
+if __name__ == '__main__':
+    lines = get_lines()
+    n_tokens = sum(len(line.split()) for line in lines)
+    print("lines:", len(lines), "tokens:", n_tokens)
+
+    assert batch_tokenize(lines) == [my_tokenizer(line) for line in lines]
+    # lines containing newlines (e.g. R8 documents) take the per-line path
+    multiline = ['The King,\nand the Queen.', 'a b', '\n', '']
+    assert batch_tokenize(multiline) == [my_tokenizer(line) for line in multiline]
+    assert batch_tokenize(multiline, remove_punct=False, lowercase=False) == [line.split() for line in multiline]
+
+    for name, func in (
+        ('my_tokenizer + dict', lambda: old_tokenize_ids(lines, {})),
+        ('batch_tokenize_ids', lambda: batch_tokenize_ids(lines, {}, add_new_words=True)),
+    ):
+        times = []
+        for _ in range(3):
+            t0 = datetime.now()
+            result = func()
+            times.append((datetime.now() - t0).total_seconds())
+        best = np.min(times)
+        print("%-20s best of 3: %.3fs  %.2fM tokens/s" % (name, best, n_tokens / best / 1e6))
+
+    old = old_tokenize_ids(lines, {})
+    new = batch_tokenize_ids(lines, {}, add_new_words=True)
+    assert new.tolist() == old
+    print("outputs match")
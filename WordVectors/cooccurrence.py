@@ -0,0 +1,193 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+import shutil
+from datetime import datetime
+
+import numpy as np
+
+from vocab import Vocab
+from nlp_util import get_wikipedia_data, get_sentences_with_word2idx_limit_vocab
+
+# Out-of-core word-word co-occurrence counts for GloVe training.
+#
+# Every pair (i, j) at distance d <= window inside a sentence adds 1 / d to
+# X[i, j] and X[j, i]. Pairs are collected as int64 keys i * V + j in a
+# bounded buffer; when it is full the buffer is sorted, duplicate keys are
+# summed and the result is spilled to disk as a sorted shard. The shards are
+# then merged k-way in key ranges (every step takes the keys up to the
+# smallest "last key" among the shards' current blocks, so memory is one
+# block per shard) into a CSR matrix:
+#   <prefix>_cooc_indptr.npy    (V + 1,) int64
+#   <prefix>_cooc_indices.npy   (nnz,) int32 column ids j
+#   <prefix>_cooc_data.npy      (nnz,) float32 X[i, j]
+# Memory stays at the buffer plus one block per shard whatever the corpus
+# size; nothing V x V is ever allocated.
+
+
+def window_pairs(tokens, sentence, window):
+    # rows i, columns j and weights 1 / d of every pair, in both directions
+    rows, cols, weights = [], [], []
+    for d in range(1, window + 1):
+        same = sentence[d:] == sentence[:-d]
+        left, right = tokens[:-d][same], tokens[d:][same]
+        w = np.full(len(left), 1 / d, dtype=np.float32)
+        rows.extend([left, right])
+        cols.extend([right, left])
+        weights.extend([w, w])
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def reduce_sorted(keys, values):
+    # sorts by key and sums the values of equal keys (in float64, the counts
+    # of frequent pairs get large)
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    if len(keys) == 0:
+        return keys, values
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+    return keys[starts], np.add.reduceat(values, starts, dtype=np.float64).astype(np.float32)
+
+
+class CooccurrenceBuilder:
+    def __init__(self, V, window=10, max_buffer=20000000, shard_dir='../large_files/cooc_shards'):
+        self.V = V
+        self.window = window
+        self.max_buffer = max_buffer
+        self.shard_dir = shard_dir
+        self.shards = []
+        self.keys = []
+        self.values = []
+        self.n_buffered = 0
+        self.n_tokens = 0
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+
+    def add_corpus(self, corpus, chunk_tokens=200000):
+        # corpus: FlatCorpus (it can be memory-mapped), read chunk by chunk
+        chunk_sentences = max(1, int(len(corpus) * chunk_tokens / max(corpus.n_tokens(), 1)))
+        for start in range(0, len(corpus), chunk_sentences):
+            chunk = corpus[start:start+chunk_sentences]
+            tokens = np.asarray(chunk.tokens, dtype=np.int64)
+            sentence = np.repeat(np.arange(len(chunk)), chunk.lengths())
+            rows, cols, weights = window_pairs(tokens, sentence, self.window)
+            # pre-aggregate the chunk, frequent pairs repeat many times in it
+            keys, values = reduce_sorted(rows * self.V + cols, weights)
+            self.keys.append(keys)
+            self.values.append(values)
+            self.n_buffered += len(keys)
+            self.n_tokens += len(tokens)
+            if self.n_buffered >= self.max_buffer:
+                self.spill()
+
+    def spill(self):
+        if not self.n_buffered:
+            return
+        keys, values = reduce_sorted(np.concatenate(self.keys), np.concatenate(self.values))
+        path = os.path.join(self.shard_dir, 'shard_%05d' % len(self.shards))
+        np.save(path + '_keys.npy', keys)
+        np.save(path + '_values.npy', values)
+        self.shards.append(path)
+        print("spilled shard %d: %d entries, %d tokens so far" % (len(self.shards) - 1, len(keys), self.n_tokens))
+        self.keys, self.values, self.n_buffered = [], [], 0
+
+    def finish(self, prefix, block_entries=4000000):
+        # k-way merge of the sorted shards into the CSR files, then the
+        # shards are deleted
+        self.spill()
+        t0 = datetime.now()
+        shards = [(np.load(p + '_keys.npy', mmap_mode='r'), np.load(p + '_values.npy', mmap_mode='r')) for p in self.shards]
+        positions = [0] * len(shards)
+        block = max(1, block_entries // max(len(shards), 1))
+        row_counts = np.zeros(self.V, dtype=np.int64)
+
+        with open(prefix + '_cooc_indices.tmp', 'wb') as f_indices, open(prefix + '_cooc_data.tmp', 'wb') as f_data:
+            while True:
+                live = [s for s in range(len(shards)) if positions[s] < len(shards[s][0])]
+                if not live:
+                    break
+                # everything up to the smallest block end is complete in this step
+                bound = min(shards[s][0][min(positions[s] + block, len(shards[s][0])) - 1] for s in live)
+                keys, values = [], []
+                for s in live:
+                    shard_keys = shards[s][0]
+                    end = positions[s] + np.searchsorted(shard_keys[positions[s]:positions[s] + block], bound, side='right')
+                    keys.append(np.asarray(shard_keys[positions[s]:end]))
+                    values.append(np.asarray(shards[s][1][positions[s]:end]))
+                    positions[s] = end
+                keys, values = reduce_sorted(np.concatenate(keys), np.concatenate(values))
+
+                rows = keys // self.V
+                row_counts += np.bincount(rows, minlength=self.V)
+                f_indices.write((keys - rows * self.V).astype(np.int32).tobytes())
+                f_data.write(values.astype(np.float32).tobytes())
+
+        del shards
+        indptr = np.zeros(self.V + 1, dtype=np.int64)
+        np.cumsum(row_counts, out=indptr[1:])
+        for name, dtype in (('indices', np.int32), ('data', np.float32)):
+            raw_to_npy(prefix + '_cooc_%s.tmp' % name, prefix + '_cooc_%s.npy' % name, dtype)
+        # indptr goes last, its presence marks a complete matrix
+        np.save(prefix + '_cooc_indptr.npy', indptr)
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
+        self.shards = []
+        print("merged into %d non-zeros in %s" % (indptr[-1], datetime.now() - t0))
+
+
+def raw_to_npy(raw_path, npy_path, dtype, block_bytes=1 << 26):
+    # copies a headerless binary file into a .npy in blocks
+    n = os.path.getsize(raw_path) // np.dtype(dtype).itemsize
+    out = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=(n,))
+    step = max(1, block_bytes // np.dtype(dtype).itemsize)
+    raw = np.memmap(raw_path, dtype=dtype, mode='r', shape=(n,)) if n else np.zeros(0, dtype=dtype)
+    for start in range(0, n, step):
+        out[start:start+step] = raw[start:start+step]
+    out.flush()
+    del out, raw
+    os.remove(raw_path)
+
+
+def build_cooccurrence(corpus, V, prefix, window=10, max_buffer=20000000, shard_dir=None):
+    t0 = datetime.now()
+    builder = CooccurrenceBuilder(V, window, max_buffer, shard_dir or prefix + '_shards')
+    builder.add_corpus(corpus)
+    builder.finish(prefix)
+    print("co-occurrence of %d tokens in %s" % (builder.n_tokens, datetime.now() - t0))
+
+
+def load_cooccurrence(prefix, mmap_mode='r'):
+    # (indptr, indices, data), as scipy.sparse.csr_matrix((data, indices, indptr)) takes them
+    return (
+        np.load(prefix + '_cooc_indptr.npy'),
+        np.load(prefix + '_cooc_indices.npy', mmap_mode=mmap_mode),
+        np.load(prefix + '_cooc_data.npy', mmap_mode=mmap_mode),
+    )
+
+
+def cooccurrence_for_source(source='brown', n_vocab=20000, window=10, rebuild=False):
+    # builds ../large_files/<source>_<n_vocab>_cooc_* and the vocab next to
+    # it (unless they exist already) and returns the prefix
+    prefix = '../large_files/%s_%d' % (source, n_vocab)
+    if not rebuild and os.path.exists(prefix + '_cooc_indptr.npy') and os.path.exists(prefix + '_counts.npy'):
+        return prefix
+
+    if source == 'wiki':
+        corpus, word2idx = get_wikipedia_data(None, n_vocab, streaming=True, flat=True, use_cache=True)
+    else:
+        corpus, word2idx = get_sentences_with_word2idx_limit_vocab(n_vocab, flat=True, use_cache=True)
+    print("%d sentences, %d tokens, %d words" % (len(corpus), corpus.n_tokens(), len(word2idx)))
+    build_cooccurrence(corpus, len(word2idx), prefix, window)
+    # the words next to the matrix, for glove_train.py / ppmi_svd.py
+    counts = np.bincount(np.asarray(corpus.tokens), minlength=len(word2idx))
+    Vocab(sorted(word2idx, key=word2idx.get), counts).save(prefix)
+    return prefix
+
+
+if __name__ == '__main__':
+    # usage: python cooccurrence.py [brown|wiki] [n vocab] [window]
+    source = sys.argv[1] if len(sys.argv) > 1 else 'brown'
+    n_vocab = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    window = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    cooccurrence_for_source(source, n_vocab, window, rebuild=True)
@@ -0,0 +1,105 @@
+from __future__ import print_function, division
+
+import os
+import json
+import shutil
+import hashlib
+
+from flat_corpus import FlatCorpus
+
+
+CACHE_DIR = '../large_files/corpus_cache/'
+
+
+def fingerprint_files(paths):
+    # cheap fingerprint of the inputs: a file that is replaced, appended to or
+    # touched gets a new size/mtime and therefore a new cache key
+    parts = []
+    for path in sorted(paths):
+        st = os.stat(path)
+        parts.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    return parts
+
+
+def sha1_hex(obj, n):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()[:n]
+
+
+def get_cache_key(name, params, source_files):
+    # <name>-<hash of the params>-<hash of everything>: entries that only
+    # differ in their inputs share the first two parts
+    return '%s-%s-%s' % (name, sha1_hex([name, params], 8),
+                         sha1_hex([name, params, fingerprint_files(source_files)], 16))
+
+
+def load_cached_corpus(key, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(path, 'word2idx.json')):
+        return None
+    with open(os.path.join(path, 'word2idx.json'), encoding='utf-8') as f:
+        word2idx = json.load(f)
+    return FlatCorpus.load(os.path.join(path, 'corpus')), word2idx
+
+
+def save_cached_corpus(key, corpus, word2idx, cache_dir=CACHE_DIR):
+    # write into a temporary directory and rename it, so a crashed or
+    # concurrent run never leaves a half written entry behind
+    path = os.path.join(cache_dir, key)
+    tmp_path = '%s.tmp%d' % (path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    try:
+        corpus.save(os.path.join(tmp_path, 'corpus'))
+        # word2idx.json is written last, it marks the entry as complete
+        with open(os.path.join(tmp_path, 'word2idx.json'), 'w', encoding='utf-8') as f:
+            json.dump(word2idx, f)
+    except BaseException:
+        # don't leave the staging directory behind
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process got there first, its entry is just as good
+        shutil.rmtree(tmp_path)
+
+
+def remove_stale_entries(key, cache_dir=CACHE_DIR):
+    # every entry is a full corpus on disk: once the one for the current
+    # inputs is saved, the older ones for the same function and params are
+    # removed (other params keep their entries, as do unfinished .tmp ones)
+    prefix = key.rsplit('-', 1)[0] + '-'
+    for entry in os.listdir(cache_dir):
+        if entry != key and entry.startswith(prefix) and '.tmp' not in entry:
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+
+def cached_corpus(name, params, source_files, build, flat=False, cache_dir=CACHE_DIR):
+    # build() must return (FlatCorpus, word2idx). The cached corpus is
+    # memory-mapped, so with flat=True a warm start only reads the vocabulary.
+    key = get_cache_key(name, params, source_files)
+    cached = load_cached_corpus(key, cache_dir)
+    if cached is None:
+        print("corpus cache miss:", key)
+        corpus, word2idx = build()
+        save_cached_corpus(key, corpus, word2idx, cache_dir)
+        remove_stale_entries(key, cache_dir)
+    else:
+        print("corpus cache hit:", key)
+        corpus, word2idx = cached
+
+    if flat:
+        return corpus, word2idx
+    return corpus.tolist(), word2idx
+
+
+def clear_corpus_cache(cache_dir=CACHE_DIR, name=None):
+    # removes stale entries (all of them, or only the ones for one function)
+    if not os.path.exists(cache_dir):
+        return
+    for entry in os.listdir(cache_dir):
+        if name is None or entry.startswith(name + '-'):
+            shutil.rmtree(os.path.join(cache_dir, entry))
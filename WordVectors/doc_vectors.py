@@ -0,0 +1,104 @@
+from __future__ import print_function, division
+from builtins import range
+
+import sys
+from datetime import datetime
+from multiprocessing import Pool, RawArray, cpu_count
+
+import numpy as np
+
+from flat_corpus import FlatCorpus
+from nlp_util import batch_tokenize_ids
+from word2vec_bin import Word2VecBin, WORD2VEC_BIN
+
+# Mean-of-word-vectors document features.
+#
+# mean_vectors() pools a tokenized corpus with one sparse x dense product.
+# parallel_mean_vectors() splits the documents into chunks for a process
+# pool: every worker opens the same word2vec .bin through Word2VecBin, so the
+# matrix is memory-mapped from the OS page cache and never copied into the
+# workers, and writes its rows into one shared output array.
+#
+# Scaling: `python doc_vectors.py [tsv file] [max processes]` prints docs/s
+# and the speed-up over one process for 1, 2, 4, 8, 16 processes. Workers
+# share nothing but the page cache and the output, so the curve follows the
+# number of physical cores; past that, or with chunks so small that the pool
+# overhead shows, it flattens (raise chunk_size).
+
+
+def mean_vectors(docs, vectors):
+    # docs: FlatCorpus of word ids, vectors: anything fancy-indexable by rows
+    # (ndarray, memmap, Word2VecBin.vectors). Only the rows of the words that
+    # occur are read. returns the (N, D) float64 means and the empty count
+    words, columns = np.unique(docs.tokens, return_inverse=True)
+    counts = FlatCorpus(columns, docs.offsets).count_matrix(len(words))
+    X = counts.dot(np.asarray(vectors[words], dtype=np.float64))
+
+    lengths = docs.lengths()
+    nonempty = lengths > 0
+    X[nonempty] /= lengths[nonempty, None]
+    return X, len(docs) - np.count_nonzero(nonempty)
+
+
+# per-process state, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(bin_path, limit, out, shape, tokenize_args):
+    _worker['word_vectors'] = Word2VecBin(bin_path, limit=limit)
+    _worker['out'] = np.frombuffer(out, dtype=np.float64).reshape(shape)
+    _worker['tokenize_args'] = tokenize_args
+
+
+def _vectorize_chunk(args):
+    start, lines = args
+    word_vectors = _worker['word_vectors']
+    docs = batch_tokenize_ids(lines, word_vectors, **_worker['tokenize_args'])
+    X, emptycount = mean_vectors(docs, word_vectors.vectors)
+    _worker['out'][start:start+len(lines)] = X
+    return emptycount
+
+
+def parallel_mean_vectors(data, bin_path=WORD2VEC_BIN, limit=None, n_jobs=None, chunk_size=1000,
+                          remove_punct=False, lowercase=False):
+    # returns the (N, D) float64 means and the number of empty documents
+    data = list(data)
+    n_jobs = n_jobs or cpu_count()
+    with open(bin_path, 'rb') as f:
+        D = int(f.readline().split()[1])
+
+    out = RawArray('d', len(data) * D)
+    chunks = [(start, data[start:start+chunk_size]) for start in range(0, len(data), chunk_size)]
+    tokenize_args = {'remove_punct': remove_punct, 'lowercase': lowercase}
+    pool = Pool(n_jobs, initializer=_init_worker, initargs=(bin_path, limit, out, (len(data), D), tokenize_args))
+    try:
+        emptycount = sum(pool.imap_unordered(_vectorize_chunk, chunks))
+    finally:
+        pool.close()
+        pool.join()
+    return np.frombuffer(out, dtype=np.float64).reshape(len(data), D), emptycount
+
+
+def scaling_curve(data, bin_path=WORD2VEC_BIN, max_jobs=16, chunk_size=1000):
+    # docs/s for 1, 2, 4, ... max_jobs processes. the warm-up run builds the
+    # .bin index if it doesn't exist yet, so it isn't timed in the first row
+    parallel_mean_vectors(data[:chunk_size], bin_path, n_jobs=1)
+    print("%-10s %12s %10s" % ('processes', 'docs/s', 'speed-up'))
+    base = None
+    n_jobs = 1
+    while n_jobs <= max_jobs:
+        t0 = datetime.now()
+        parallel_mean_vectors(data, bin_path, n_jobs=n_jobs, chunk_size=chunk_size)
+        rate = len(data) / (datetime.now() - t0).total_seconds()
+        base = base or rate
+        print("%-10d %12.0f %10.2f" % (n_jobs, rate, rate / base))
+        n_jobs *= 2
+
+
+if __name__ == '__main__':
+    # usage: python doc_vectors.py [tsv file] [max processes]
+    path = sys.argv[1] if len(sys.argv) > 1 else '../large_files/r8-train-all-terms.txt'
+    max_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    data = [line.split('\t', 1)[1] for line in open(path, encoding='utf-8') if '\t' in line]
+    print("%d documents, %d cores" % (len(data), cpu_count()))
+    scaling_curve(data, max_jobs=max_jobs)
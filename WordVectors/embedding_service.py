@@ -0,0 +1,251 @@
+from __future__ import print_function, division
+
+import sys
+import json
+import asyncio
+from datetime import datetime
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from similarity_index import SimilarityIndex
+from nlp_util import batch_tokenize_ids
+from vocab import Vocab
+
+# Local HTTP/JSON service over a loaded embedding, stdlib asyncio only:
+#   GET  /vector?word=king
+#   GET  /neighbors?word=king&k=10
+#   GET  /analogy?a=king&b=man&c=woman&k=1     (a - b + c)
+#   GET  /vectorize?text=...   or POST /vectorize {"sentences": [...]}
+#   GET  /words?n=1000         the n most frequent words, for load tests
+#   GET  /stats                batching counters
+#
+# Neighbor and analogy queries are not scored one by one: the MicroBatcher
+# collects them for up to max_wait_ms (or until max_batch_size are waiting)
+# and scores the whole batch with a single (B, D) x (D, V) matmul in a worker
+# thread, so the event loop keeps accepting requests meanwhile.
+
+
+def param(params, name):
+    if name not in params:
+        raise ValueError("missing parameter: %s" % name)
+    return params[name]
+
+
+def positive_int(params, name, default):
+    value = int(params.get(name, default))
+    if value < 1:
+        raise ValueError("%s must be at least 1" % name)
+    return value
+
+
+class MicroBatcher:
+    def __init__(self, index, max_batch_size=64, max_wait_ms=2.0):
+        self.index = index
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.n_batches = 0
+        self.n_queries = 0
+        self.max_seen = 0
+
+    async def top_k(self, v, k, exclude):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((v, k, exclude, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(None, self.score, batch)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def score(self, batch):
+        # one matmul for the batch, excluded rows padded with their first entry
+        Q = np.array([v for v, _, _, _ in batch], dtype=np.float32)
+        k = max(k for _, k, _, _ in batch)
+        width = max(len(e) for _, _, e, _ in batch)
+        exclude = np.array([list(e) + [e[0]] * (width - len(e)) for _, _, e, _ in batch], dtype=np.int64)
+
+        idx, scores = self.index.top_k_batch(Q, min(k, self.index.V - width), exclude)
+        self.n_batches += 1
+        self.n_queries += len(batch)
+        self.max_seen = max(self.max_seen, len(batch))
+        return [(idx[i, :kk], scores[i, :kk]) for i, (_, kk, _, _) in enumerate(batch)]
+
+
+class EmbeddingService:
+    def __init__(self, embedding, vocab, max_batch_size=64, max_wait_ms=2.0):
+        self.embedding = embedding
+        self.vocab = vocab
+        self.index = SimilarityIndex(embedding, cache_size=0)
+        self.batcher = MicroBatcher(self.index, max_batch_size, max_wait_ms)
+        self.routes = {
+            '/vector': self.vector,
+            '/neighbors': self.neighbors,
+            '/analogy': self.analogy,
+            '/vectorize': self.vectorize,
+            '/words': self.words,
+            '/stats': self.stats,
+        }
+
+    def lookup(self, word):
+        idx = self.vocab.get(word)
+        if idx is None:
+            raise KeyError("%s not in dictionary" % word)
+        return idx
+
+    def ranked(self, idx, scores):
+        return [[self.vocab.word(i), float(s)] for i, s in zip(idx, scores)]
+
+    async def vector(self, params, body):
+        word = param(params, 'word')
+        idx = self.lookup(word)
+        return {'word': word, 'vector': self.embedding[idx].tolist()}
+
+    async def neighbors(self, params, body):
+        word = param(params, 'word')
+        idx = self.lookup(word)
+        k = positive_int(params, 'k', 10)
+        top, scores = await self.batcher.top_k(self.index.embedding[idx], k, [idx])
+        return {'word': word, 'neighbors': self.ranked(top, scores)}
+
+    async def analogy(self, params, body):
+        words = [param(params, w) for w in ('a', 'b', 'c')]
+        a, b, c = (self.lookup(w) for w in words)
+        k = positive_int(params, 'k', 1)
+        E = self.index.embedding
+        top, scores = await self.batcher.top_k(E[a] - E[b] + E[c], k, [a, b, c])
+        return {'analogy': words, 'results': self.ranked(top, scores)}
+
+    async def vectorize(self, params, body):
+        # mean of the word vectors per sentence, zeros when no word is known.
+        # lowercase=0 keeps the case, for case-sensitive vectors (word2vec)
+        if body:
+            data = json.loads(body.decode('utf-8'))
+            sentences = data.get('sentences') if isinstance(data, dict) else None
+            if not isinstance(sentences, list) or not all(isinstance(t, str) for t in sentences):
+                raise ValueError('the body must be {"sentences": [strings]}')
+        else:
+            sentences = [param(params, 'text')]
+        lowercase = params.get('lowercase', '1') != '0'
+        X = np.zeros((len(sentences), self.index.D), dtype=np.float32)
+        for n, idxs in enumerate(batch_tokenize_ids(sentences, self.vocab, lowercase=lowercase)):
+            if len(idxs) > 0:
+                X[n] = self.index.embedding[idxs].mean(axis=0)
+        return {'vectors': X.tolist()}
+
+    async def words(self, params, body):
+        n = min(int(params.get('n', 1000)), self.index.V)
+        return {'words': [self.vocab.word(i) for i in range(n)]}
+
+    async def stats(self, params, body):
+        b = self.batcher
+        return {
+            'batches': b.n_batches,
+            'queries': b.n_queries,
+            'mean_batch_size': b.n_queries / b.n_batches if b.n_batches else 0,
+            'max_batch_size_seen': b.max_seen,
+            'max_batch_size': b.max_batch_size,
+            'max_wait_ms': b.max_wait * 1000,
+        }
+
+    async def handle(self, reader, writer):
+        # minimal HTTP/1.1 with keep-alive, one request at a time per connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+
+                url = urlsplit(target)
+                params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+                status, result = await self.dispatch(url.path, params, body)
+
+                payload = json.dumps(result).encode('utf-8')
+                writer.write(('HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                              % (status, len(payload))).encode('latin-1') + payload)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, path, params, body):
+        route = self.routes.get(path)
+        if route is None:
+            return '404 Not Found', {'error': 'unknown path: %s' % path}
+        try:
+            return '200 OK', await route(params, body)
+        except KeyError as e:
+            return '404 Not Found', {'error': str(e).strip('"\'')}
+        except ValueError as e:
+            return '400 Bad Request', {'error': str(e)}
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        batcher = asyncio.ensure_future(self.batcher.run())
+        print("serving on http://%s:%d (max batch size %d, max wait %.1f ms)" % (
+            host, port, self.batcher.max_batch_size, self.batcher.max_wait * 1000))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def load_vectors(path, limit=1000000):
+    # a GloVe text file (through the binary store) or a word2vec .bin, of
+    # which only the `limit` most frequent rows are read
+    if path.endswith('.bin'):
+        from word2vec_bin import Word2VecBin
+        words, embedding = Word2VecBin(path).load_top_n(limit)
+        return embedding, Vocab(words)
+    from embedding_store import load_glove
+    return load_glove(path)
+
+
+if __name__ == '__main__':
+    # usage: python embedding_service.py [glove txt or word2vec bin] [port] [max batch size] [max wait ms]
+    path = sys.argv[1] if len(sys.argv) > 1 else '../large_files/glove.6b/glove.6b.50d.txt'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8000
+    max_batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    max_wait_ms = float(sys.argv[4]) if len(sys.argv) > 4 else 2.0
+
+    print("Loading word vectors...")
+    t0 = datetime.now()
+    embedding, vocab = load_vectors(path)
+    service = EmbeddingService(embedding, vocab, max_batch_size, max_wait_ms)
+    print("loaded %d x %d in %s" % (service.index.V, service.index.D, datetime.now() - t0))
+    asyncio.run(service.serve(port=port))
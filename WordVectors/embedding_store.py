@@ -0,0 +1,115 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from vocab import Vocab
+
+# Binary embedding store: the GloVe text file is parsed once into
+#   <prefix>_vectors.npy   float32 (V, D) matrix
+#   <prefix>_words.npy, <prefix>_word_offsets.npy, <prefix>_counts.npy   Vocab.save()
+# and memory-mapped from then on. np.load(mmap_mode='r') maps the file
+# read-only, so every process using the same store shares its pages.
+
+
+def count_lines(path):
+    n = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            n += block.count(b'\n')
+            last = block[-1:]
+    # the last line may have no trailing newline
+    return n + (last != b'\n')
+
+
+def parse_glove_line(line, D=None):
+    # the vector is always the last D fields; the word itself may contain
+    # spaces in some GloVe releases (e.g. glove.840B)
+    line = line.rstrip()
+    if D is None:
+        values = line.split(' ')
+        return values[0], values[1:]
+    values = line.rsplit(' ', D)
+    return values[0], values[1:]
+
+
+def convert_glove_txt(txt_path, prefix):
+    print("converting", txt_path, "->", prefix)
+    t0 = datetime.now()
+
+    with open(txt_path, encoding='utf-8') as f:
+        _, first = parse_glove_line(next(f))
+    D = len(first)
+    V = count_lines(txt_path)
+
+    vocab = Vocab()
+    vectors = np.lib.format.open_memmap(prefix + '_vectors.npy.tmp', mode='w+', dtype=np.float32, shape=(V, D))
+    n = 0
+    try:
+        with open(txt_path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                word, values = parse_glove_line(line, D)
+                if word in vocab:
+                    # duplicates keep the first vector
+                    continue
+                vocab.add(word)
+                vectors[n] = np.asarray(values, dtype=np.float32)
+                n += 1
+        vectors.flush()
+    except BaseException:
+        # don't leave a half-written matrix behind
+        del vectors
+        os.remove(prefix + '_vectors.npy.tmp')
+        raise
+    del vectors
+
+    if n != V:
+        # blank or duplicate lines: shrink to the rows actually written
+        vectors = np.load(prefix + '_vectors.npy.tmp', mmap_mode='r')[:n]
+        np.save(prefix + '_vectors.npy', vectors)
+        del vectors
+        os.remove(prefix + '_vectors.npy.tmp')
+    else:
+        os.replace(prefix + '_vectors.npy.tmp', prefix + '_vectors.npy')
+    # the vocab files go last, their presence marks a complete store
+    vocab.save(prefix)
+
+    print("converted %d x %d vectors in %s" % (n, D, datetime.now() - t0))
+
+
+def store_exists(prefix):
+    return all(os.path.exists(prefix + suffix) for suffix in ('_vectors.npy', '_words.npy', '_word_offsets.npy', '_counts.npy'))
+
+
+def load_embeddings(prefix, mmap_mode='r'):
+    # returns the (V, D) float32 matrix and a frozen Vocab, both memory-mapped
+    embedding = np.load(prefix + '_vectors.npy', mmap_mode=mmap_mode)
+    vocab = Vocab.load(prefix, mmap_mode=mmap_mode)
+    return embedding, vocab
+
+
+def load_glove(txt_path, mmap_mode='r'):
+    # converts the text file next to itself on first use (or when the text
+    # file is newer than the store), memory-maps the binary store after that
+    prefix = os.path.splitext(txt_path)[0]
+    if not store_exists(prefix) or os.path.getmtime(txt_path) > os.path.getmtime(prefix + '_counts.npy'):
+        convert_glove_txt(txt_path, prefix)
+    return load_embeddings(prefix, mmap_mode)
+
+
+if __name__ == '__main__':
+    # usage: python embedding_store.py <glove txt file> [output prefix]
+    txt_path = sys.argv[1] if len(sys.argv) > 1 else '../large_files/glove.6b/glove.6b.50d.txt'
+    prefix = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(txt_path)[0]
+    convert_glove_txt(txt_path, prefix)
+
+    t0 = datetime.now()
+    embedding, vocab = load_embeddings(prefix)
+    print("loaded %d x %d in %s" % (embedding.shape[0], embedding.shape[1], datetime.now() - t0))
@@ -0,0 +1,117 @@
+from __future__ import print_function, division
+from builtins import range
+
+import numpy as np
+
+
+# A corpus of indexed sentences stored as one contiguous int32 token array
+# plus an int64 offsets array: sentence i is tokens[offsets[i]:offsets[i+1]].
+# A list of lists of python ints costs ~36 bytes per token, this costs 4.
+class FlatCorpus:
+    def __init__(self, tokens, offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    @classmethod
+    def from_sentences(cls, sentences, chunk_size=1000000):
+        # sentences can be any iterable (e.g. the streaming wiki generator),
+        # tokens are flushed into int32 chunks so we never hold a big list
+        token_chunks = []
+        length_chunks = []
+        tokens = []
+        lengths = []
+        for sentence in sentences:
+            tokens.extend(sentence)
+            lengths.append(len(sentence))
+            if len(tokens) >= chunk_size:
+                token_chunks.append(np.array(tokens, dtype=np.int32))
+                length_chunks.append(np.array(lengths, dtype=np.int64))
+                tokens = []
+                lengths = []
+        token_chunks.append(np.array(tokens, dtype=np.int32))
+        length_chunks.append(np.array(lengths, dtype=np.int64))
+
+        lengths = np.concatenate(length_chunks)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(np.concatenate(token_chunks), offsets)
+
+    @classmethod
+    def concatenate(cls, corpora):
+        tokens = [np.zeros(0, dtype=np.int32)]
+        lengths = [np.zeros(0, dtype=np.int64)]
+        for c in corpora:
+            tokens.append(np.asarray(c.tokens, dtype=np.int32))
+            lengths.append(c.lengths())
+        tokens = np.concatenate(tokens)
+        lengths = np.concatenate(lengths)
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(tokens, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        tokens, offsets = self.tokens, self.offsets
+        for i in range(len(self)):
+            yield tokens[offsets[i]:offsets[i+1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                return FlatCorpus.from_sentences(self[j] for j in range(start, stop, step))
+            stop = max(start, stop)
+            offsets = self.offsets[start:stop+1]
+            return FlatCorpus(self.tokens[offsets[0]:offsets[-1]], offsets - offsets[0])
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("sentence index out of range")
+        return self.tokens[self.offsets[i]:self.offsets[i+1]]
+
+    def n_tokens(self):
+        return len(self.tokens)
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def select(self, mask):
+        # keeps the sentences where mask is True, without a python loop
+        lengths = self.lengths()
+        tokens = np.asarray(self.tokens)[np.repeat(mask, lengths)]
+        offsets = np.zeros(np.count_nonzero(mask) + 1, dtype=np.int64)
+        np.cumsum(lengths[mask], out=offsets[1:])
+        return FlatCorpus(tokens, offsets)
+
+    def tolist(self):
+        tokens = np.asarray(self.tokens).tolist()
+        offsets = np.asarray(self.offsets).tolist()
+        return [tokens[offsets[i]:offsets[i+1]] for i in range(len(self))]
+
+    def count_matrix(self, n_cols=None):
+        # scipy CSR sentence x token-id matrix of counts, built straight from
+        # tokens / offsets (duplicate ids in a row are summed)
+        from scipy.sparse import csr_matrix
+        tokens = np.asarray(self.tokens)
+        if n_cols is None:
+            n_cols = int(tokens.max()) + 1 if len(tokens) else 0
+        counts = csr_matrix(
+            (np.ones(len(tokens), dtype=np.float64), tokens, np.asarray(self.offsets)),
+            shape=(len(self), n_cols),
+        )
+        counts.sum_duplicates()
+        return counts
+
+    def save(self, prefix):
+        np.save(prefix + '_tokens.npy', np.asarray(self.tokens, dtype=np.int32))
+        np.save(prefix + '_offsets.npy', np.asarray(self.offsets, dtype=np.int64))
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        # with mmap_mode='r' nothing is read until a sentence is accessed
+        tokens = np.load(prefix + '_tokens.npy', mmap_mode=mmap_mode)
+        offsets = np.load(prefix + '_offsets.npy', mmap_mode=mmap_mode)
+        return cls(tokens, offsets)
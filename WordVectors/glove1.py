@@ -2,8 +2,13 @@ from __future__ import print_function, division
 from future.utils import iteritems
 from builtins import range
 
+import os
+import sys
 import numpy as np
-from sklearn.metrics.pairwise import pairwise_distances
+
+from embedding_store import load_glove, load_embeddings
+from similarity_index import SimilarityIndex
+from analogy_eval import evaluate_analogies, ANALOGY_FILE
 
 def dist1(a, b):
     return np.linalg.norm(a - b)
@@ -17,56 +22,39 @@ dist, metric = dist2, 'cosine'
 
 def find_analogies(w1, w2, w3):
     for w in (w1, w2, w3):
-        if w not in word2vec:
+        if w not in vocab:
             print("%s not in dictionary " % w)
             return
 
-    king = word2vec[w1]
-    man = word2vec[w2]
-    woman = word2vec[w3]
-    v0 = king - man + woman
-
-    distances = pairwise_distances(v0.reshape(1, D), embedding, metric=metric).reshape(V)
-    idxs = distances.argsort()[:4]
-
-    for idx in idxs:
-        word = idx2word[idx]
-        if word not in (w1, w2, w3):
-            best_word = word
-            break
-
+    # king - man + woman, repeated questions come from the index's LRU cache
+    idxs, _ = index.analogy([vocab[w1], vocab[w3]], [vocab[w2]], 1, metric=metric)
+    best_word = vocab.word(idxs[0])
 
     print(w1, "-", w2, "=", best_word, "-", w3)
 
 def nearest_neighbors(w, n=5):
-    if w not in word2vec:
+    if w not in vocab:
         print("%s not in dictionary" % w)
         return
 
-    v = word2vec[w]
-    distances = pairwise_distances(v.reshape(1, D), embedding, metric=metric).reshape(V)
-    idxs = distances.argsort()[1:n+1]
+    idxs, _ = index.nearest_neighbors(vocab[w], n, metric=metric)
     print("neighbors of: %s" % w)
     for idx in idxs:
-        print("\t%s" % idx2word[idx])
+        print("\t%s" % vocab.word(idx))
 
 print("Loading word vectors...")
-word2vec = {}
-embedding = []
-idx2word = []
-with open('../large_files/glove.6b/glove.6b.50d.txt', encoding="utf-8") as f:
-
-    for line in f:
-        values = line.split()
-        word = values[0]
-        vec = np.asarray(values[1:], dtype='float32')
-        word2vec[word] = vec
-        embedding.append(vec)
-        idx2word.append(word)
-
-    print('Found %s word vectors.' % len(word2vec))
-    embedding = np.array(embedding)
-    V, D = embedding.shape
+if len(sys.argv) > 1 and sys.argv[1].endswith('.txt'):
+    # python glove1.py <file.txt>: any GloVe-format text file (e.g. from glove_train.py)
+    embedding, vocab = load_glove(sys.argv[1])
+elif len(sys.argv) > 1:
+    # python glove1.py <prefix>: a pruned store from prune_embeddings.py
+    embedding, vocab = load_embeddings(sys.argv[1])
+else:
+    # parsed once into a binary store next to the text file, memory-mapped after that
+    embedding, vocab = load_glove('../large_files/glove.6b/glove.6b.50d.txt')
+print('Found %s word vectors.' % len(vocab))
+V, D = embedding.shape
+index = SimilarityIndex(embedding)
 
 find_analogies('king', 'man', 'woman')
 find_analogies('france', 'paris', 'london')
@@ -103,3 +91,8 @@ nearest_neighbors('nephew')
 nearest_neighbors('february')
 nearest_neighbors('rome')
 
+print("query cache:", index.cache.stats())
+
+# the whole benchmark, scored in blocked matrix products
+if os.path.exists(ANALOGY_FILE):
+    evaluate_analogies(embedding, vocab.word2idx, ANALOGY_FILE, index=index)
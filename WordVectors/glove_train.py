@@ -0,0 +1,131 @@
+from __future__ import print_function, division
+from builtins import range
+
+import sys
+from datetime import datetime
+from multiprocessing import Pool, RawArray, cpu_count
+
+import numpy as np
+
+from vocab import Vocab
+from cooccurrence import load_cooccurrence
+
+# GloVe (Pennington et al. 2014) trained with AdaGrad on the CSR
+# co-occurrence matrix from cooccurrence.py:
+#   J = sum f(X_ij) (w_i . c_j + b_i + b~_j - log X_ij)^2,  f(x) = min(1, (x / x_max)^alpha)
+#
+# The parameters and the AdaGrad accumulators live in shared memory
+# (RawArray). Every epoch the non-zeros are cut into blocks in random order;
+# worker processes train their blocks in vectorized minibatches and write
+# straight into the shared arrays without locks (Hogwild, Recht et al. 2011):
+# with a sparse X two batches rarely touch the same rows at the same time.
+# The matrix itself is memory-mapped by every worker, never copied.
+
+
+# per-process views of the shared arrays and the matrix, set by _init_worker
+_shared = {}
+
+
+def _init_worker(buffers, V, D, prefix, params):
+    for name, buf in buffers.items():
+        shape = (V, D) if name in ('W', 'C', 'gW', 'gC') else (V,)
+        _shared[name] = np.frombuffer(buf, dtype=np.float32).reshape(shape)
+    _shared['indptr'], _shared['indices'], _shared['data'] = load_cooccurrence(prefix)
+    _shared['params'] = params
+
+
+def _train_block(args):
+    start, end, seed = args
+    s = _shared
+    x_max, alpha, lr, batch_size = s['params']
+    rng = np.random.RandomState(seed)
+
+    # the row of every entry comes from indptr, no (nnz,) row array is kept
+    positions = start + rng.permutation(end - start)
+    rows_all = np.searchsorted(s['indptr'], positions, side='right') - 1
+    cols_all = np.asarray(s['indices'][start:end])[positions - start]
+    x_all = np.asarray(s['data'][start:end], dtype=np.float32)[positions - start]
+
+    cost = 0.0
+    for b in range(0, len(positions), batch_size):
+        i, j, x = rows_all[b:b+batch_size], cols_all[b:b+batch_size], x_all[b:b+batch_size]
+        w, c = s['W'][i], s['C'][j]
+        diff = (w * c).sum(axis=1) + s['bW'][i] + s['bC'][j] - np.log(x)
+        fdiff = np.minimum(1, (x / x_max) ** alpha) * diff
+        cost += 0.5 * (fdiff * diff).sum()
+
+        grad_w = fdiff[:, None] * c
+        grad_c = fdiff[:, None] * w
+        # AdaGrad: step by lr / sqrt(sum of squared past gradients)
+        np.add.at(s['W'], i, -lr * grad_w / np.sqrt(s['gW'][i]))
+        np.add.at(s['C'], j, -lr * grad_c / np.sqrt(s['gC'][j]))
+        np.add.at(s['bW'], i, -lr * fdiff / np.sqrt(s['gbW'][i]))
+        np.add.at(s['bC'], j, -lr * fdiff / np.sqrt(s['gbC'][j]))
+        np.add.at(s['gW'], i, grad_w ** 2)
+        np.add.at(s['gC'], j, grad_c ** 2)
+        np.add.at(s['gbW'], i, fdiff ** 2)
+        np.add.at(s['gbC'], j, fdiff ** 2)
+    return cost
+
+
+def train_glove(prefix, V, D=100, epochs=25, x_max=100.0, alpha=0.75, lr=0.05, n_jobs=None,
+                batch_size=1024, block_entries=200000, seed=0):
+    # returns W + C (the sum GloVe reports as the word vectors) and the costs
+    n_jobs = n_jobs or cpu_count()
+    rng = np.random.RandomState(seed)
+    indptr, _, _ = load_cooccurrence(prefix)
+    nnz = int(indptr[-1])
+
+    buffers = {}
+    for name in ('W', 'C', 'gW', 'gC'):
+        buffers[name] = RawArray('f', V * D)
+    for name in ('bW', 'bC', 'gbW', 'gbC'):
+        buffers[name] = RawArray('f', V)
+    arrays = dict((name, np.frombuffer(buf, dtype=np.float32)) for name, buf in buffers.items())
+    arrays['W'][:] = (rng.random_sample(V * D) - 0.5) / D
+    arrays['C'][:] = (rng.random_sample(V * D) - 0.5) / D
+    for name in ('gW', 'gC', 'gbW', 'gbC'):
+        arrays[name][:] = 1
+
+    blocks = [(start, min(start + block_entries, nnz)) for start in range(0, nnz, block_entries)]
+    pool = Pool(n_jobs, initializer=_init_worker,
+                initargs=(buffers, V, D, prefix, (x_max, alpha, lr, batch_size)))
+    costs = []
+    try:
+        for epoch in range(epochs):
+            t0 = datetime.now()
+            order = rng.permutation(len(blocks))
+            tasks = [blocks[k] + (seed * 1000003 + epoch * len(blocks) + k,) for k in order]
+            cost = sum(pool.imap_unordered(_train_block, tasks))
+            elapsed = (datetime.now() - t0).total_seconds()
+            costs.append(cost / max(nnz, 1))
+            print("epoch %d: cost %.5f, %.0f entries/s, %s" % (epoch, costs[-1], nnz / elapsed, datetime.now() - t0))
+    finally:
+        pool.close()
+        pool.join()
+
+    W = arrays['W'].reshape(V, D) + arrays['C'].reshape(V, D)
+    return W, costs
+
+
+def save_glove_txt(path, W, words):
+    # the format of the released GloVe files, glove1.py / load_glove read it
+    with open(path, 'w', encoding='utf-8') as f:
+        for word, row in zip(words, W):
+            f.write(word + ' ' + ' '.join('%.6f' % v for v in row) + '\n')
+
+
+if __name__ == '__main__':
+    # usage: python glove_train.py [cooccurrence prefix] [D] [epochs] [processes]
+    # the prefix is the one cooccurrence.py wrote, e.g. ../large_files/brown_20000
+    prefix = sys.argv[1] if len(sys.argv) > 1 else '../large_files/brown_20000'
+    D = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    epochs = int(sys.argv[3]) if len(sys.argv) > 3 else 25
+    n_jobs = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    vocab = Vocab.load(prefix)
+    words = vocab.idx2word
+    W, costs = train_glove(prefix, len(words), D, epochs, n_jobs=n_jobs)
+    out = '%s_glove.%dd.txt' % (prefix, D)
+    save_glove_txt(out, W, words)
+    print("wrote", out, "- try it with: python glove1.py", out)
@@ -0,0 +1,80 @@
+from __future__ import print_function, division
+
+import sys
+import json
+import asyncio
+from urllib.parse import urlencode
+
+import numpy as np
+
+# Load test for embedding_service.py: n_clients concurrent keep-alive
+# connections send neighbor and analogy queries over the n_words most
+# frequent words, then p50 / p99 latency, QPS and the server's batching
+# counters are reported.
+
+
+async def request(reader, writer, path, params):
+    writer.write(('GET %s?%s HTTP/1.1\r\nHost: localhost\r\n\r\n' % (path, urlencode(params))).encode('latin-1'))
+    await writer.drain()
+    status = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    body = await reader.readexactly(length)
+    if b' 200 ' not in status:
+        raise RuntimeError("%s %s: %s" % (path, status.decode('latin-1').strip(), body.decode('utf-8')))
+    return json.loads(body.decode('utf-8'))
+
+
+async def client(host, port, words, n_requests, seed, latencies):
+    rng = np.random.RandomState(seed)
+    loop = asyncio.get_running_loop()
+    reader, writer = await asyncio.open_connection(host, port)
+    for _ in range(n_requests):
+        if rng.rand() < 0.5:
+            path, params = '/neighbors', {'word': words[rng.randint(len(words))], 'k': 10}
+        else:
+            a, b, c = rng.choice(len(words), 3, replace=False)
+            path, params = '/analogy', {'a': words[a], 'b': words[b], 'c': words[c]}
+        t0 = loop.time()
+        await request(reader, writer, path, params)
+        latencies.append(loop.time() - t0)
+    writer.close()
+
+
+async def load_test(host='127.0.0.1', port=8000, n_clients=64, n_requests=100, n_words=10000):
+    reader, writer = await asyncio.open_connection(host, port)
+    words = (await request(reader, writer, '/words', {'n': n_words}))['words']
+    before = await request(reader, writer, '/stats', {})
+
+    latencies = []
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    await asyncio.gather(*[client(host, port, words, n_requests, seed, latencies) for seed in range(n_clients)])
+    elapsed = loop.time() - t0
+
+    after = await request(reader, writer, '/stats', {})
+    writer.close()
+
+    ms = np.array(latencies) * 1000
+    batches = after['batches'] - before['batches']
+    queries = after['queries'] - before['queries']
+    print("clients: %d, requests: %d, max batch size: %d, max wait: %.1f ms" % (
+        n_clients, len(ms), after['max_batch_size'], after['max_wait_ms']))
+    print("p50: %.2f ms  p99: %.2f ms  mean: %.2f ms" % (np.percentile(ms, 50), np.percentile(ms, 99), ms.mean()))
+    print("QPS: %.0f" % (len(ms) / elapsed))
+    print("batches: %d, mean batch size: %.1f" % (batches, queries / batches if batches else 0))
+    return ms, elapsed
+
+
+if __name__ == '__main__':
+    # usage: python load_test_service.py [port] [n clients] [requests per client]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    n_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    n_requests = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    asyncio.run(load_test(port=port, n_clients=n_clients, n_requests=n_requests))
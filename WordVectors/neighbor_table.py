@@ -0,0 +1,102 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from similarity_index import SimilarityIndex, select_top_k
+
+# Cosine top-k neighbors of every word, precomputed once:
+#   <prefix>_nn_idx.npy      (V, k) int32 neighbor ids, best first
+#   <prefix>_nn_scores.npy   (V, k) float16 cosine similarities
+# The rows are split into tiles sized so that the (tile, V) working arrays
+# of all threads fit in memory_budget bytes. Each tile is one matmul
+# against the normalized matrix plus an argpartition, and tiles run on a
+# thread pool (BLAS and argpartition release the GIL). Every tile writes its
+# own rows of the output memmaps, so the threads never share a row.
+
+
+def tile_rows(V, n_threads, memory_budget):
+    # rows per tile, so that the working arrays of n_threads tiles fit the
+    # budget. a tile holds 16 bytes per (row, word): the float32 scores, the
+    # negated float32 copy select_top_k partitions and its int64 argpartition
+    return max(1, min(V, int(memory_budget // (n_threads * V * 16))))
+
+
+def build_neighbor_table(embedding, prefix, k=20, n_threads=None, memory_budget=1 << 30):
+    t0 = datetime.now()
+    index = SimilarityIndex(embedding, cache_size=0)
+    V = index.V
+    k = min(k, V - 1)
+    n_threads = n_threads or os.cpu_count() or 1
+    rows = tile_rows(V, n_threads, memory_budget)
+
+    idx_out = np.lib.format.open_memmap(prefix + '_nn_idx.npy.tmp', mode='w+', dtype=np.int32, shape=(V, k))
+    scores_out = np.lib.format.open_memmap(prefix + '_nn_scores.npy.tmp', mode='w+', dtype=np.float16, shape=(V, k))
+
+    def run_tile(start):
+        end = min(start + rows, V)
+        scores = index.normed[start:end].dot(index.normed.T)
+        # a word is not its own neighbor
+        scores[np.arange(end - start), np.arange(start, end)] = -np.inf
+        idx, top = select_top_k(scores, k)
+        idx_out[start:end] = idx
+        scores_out[start:end] = top
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        # list() re-raises the first exception of any tile
+        list(pool.map(run_tile, range(0, V, rows)))
+
+    idx_out.flush()
+    scores_out.flush()
+    del idx_out, scores_out
+    os.replace(prefix + '_nn_scores.npy.tmp', prefix + '_nn_scores.npy')
+    # the ids go last, their presence marks a complete table
+    os.replace(prefix + '_nn_idx.npy.tmp', prefix + '_nn_idx.npy')
+    print("top-%d neighbors of %d words (%d rows per tile, %d threads) in %s" % (
+        k, V, rows, n_threads, datetime.now() - t0))
+
+
+class NeighborTable:
+    def __init__(self, idx, scores):
+        self.idx = idx
+        self.scores = scores
+        self.V, self.k = idx.shape
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        return cls(
+            np.load(prefix + '_nn_idx.npy', mmap_mode=mmap_mode),
+            np.load(prefix + '_nn_scores.npy', mmap_mode=mmap_mode),
+        )
+
+    def neighbors(self, word_idx, k=None):
+        # O(1): one row of each memmap
+        k = k or self.k
+        return np.asarray(self.idx[word_idx, :k]), np.asarray(self.scores[word_idx, :k], dtype=np.float32)
+
+
+if __name__ == '__main__':
+    # usage: python neighbor_table.py [glove txt file] [k] [threads] [memory budget MB]
+    path = sys.argv[1] if len(sys.argv) > 1 else '../large_files/glove.6b/glove.6b.50d.txt'
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    n_threads = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    budget = int(float(sys.argv[4]) * (1 << 20)) if len(sys.argv) > 4 else 1 << 30
+
+    from embedding_store import load_glove
+    print("Loading word vectors...")
+    embedding, vocab = load_glove(path)
+    prefix = os.path.splitext(path)[0]
+    build_neighbor_table(embedding, prefix, k, n_threads, budget)
+
+    table = NeighborTable.load(prefix)
+    for word in ('king', 'france', 'japan', 'einstein', 'woman'):
+        if word in vocab:
+            idx, scores = table.neighbors(vocab[word], 5)
+            print("neighbors of: %s" % word)
+            for i, s in zip(idx, scores):
+                print("\t%s\t%.3f" % (vocab.word(i), s))
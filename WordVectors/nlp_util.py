@@ -2,12 +2,14 @@
 from __future__ import print_function, division
 from builtins import range
 
+import gc
 import os
 import string
 import sys
-import operator
-
-from sklearn.metrics.pairwise import pairwise_distances
+import weakref
+from collections import Counter
+from itertools import chain, repeat
+from multiprocessing import Pool, cpu_count
 
 # import nltk
 # nltk.download()
@@ -15,26 +17,39 @@ from nltk.corpus import brown
 
 import numpy as np
 
+from flat_corpus import FlatCorpus
+from vocab import Vocab
+from similarity_index import SimilarityIndex
+from corpus_cache import cached_corpus
 
-def find_analogies(w1, w2, w3, We, word2idx, idx2word):
-    V, D = We.shape
 
-    king = We[word2idx[w1]]
-    man = We[word2idx[w2]]
-    woman = We[word2idx[w3]]
-    v0 = king - man - woman
+# (weakref to the matrix, its SimilarityIndex) of the last find_analogies
+# call without an index, so a run of calls on the same We builds it once
+_last_index = [None, None]
 
-    for dist in ('euclidean', 'cosine'):
-        distances = pairwise_distances(v0.reshape(1,D), We, metric=dist).reshape(V)
 
-        idx = distances.argsort()[:4]
-        best_idx = -1
-        keep_out = [word2idx[w] for w in (w1, w2, w3)]
-        for i in idx:
-            if i not in keep_out:
-                best_idx = i
-                break
-        best_word = idx2word[best_idx]
+def _index_for(We):
+    ref, index = _last_index
+    if ref is None or ref() is not We:
+        index = SimilarityIndex(We)
+        _last_index[:] = [weakref.ref(We), index]
+    return index
+
+
+def find_analogies(w1, w2, w3, We, word2idx, idx2word, index=None):
+    # without an index, the one of the last call is reused while We is the
+    # same array. a We that is changed in place in between needs its own
+    # index, refreshed with index.set_embedding(We)
+    if index is None:
+        index = _index_for(We)
+
+    # v0 = king - man - woman
+    positive = [word2idx[w1]]
+    negative = [word2idx[w2], word2idx[w3]]
+
+    for dist in ('euclidean', 'cosine'):
+        idx, _ = index.analogy(positive, negative, 1, metric=dist)
+        best_word = idx2word[idx[0]]
 
         print("closest match by", dist, "distance: ", best_word)
         print(w1, "-", w2, "=",best_word, "-", w3)
@@ -60,8 +75,101 @@ def my_tokenizer(s):
     return s.split()
 
 
-def get_wikipedia_data(n_files, n_vocab, by_paragraph=False):
-    prefix = '../large_files/enwiki-articles1/AB/'
+def tokenize_line(line, remove_punct=True, lowercase=True):
+    if remove_punct:
+        line = remove_punctuation(line)
+    if lowercase:
+        line = line.lower()
+    return line.split()
+
+
+def batch_tokenize(lines, remove_punct=True, lowercase=True):
+    # same result as [my_tokenizer(line) for line in lines], but translate()
+    # and lower() run once over the joined batch instead of once per line.
+    # Only the R8 vectorizers turn remove_punct/lowercase off, to keep their
+    # own tokenization. Lines containing '\n' can't be joined, they are
+    # tokenized one at a time instead.
+    lines = list(lines)
+    if not lines:
+        return []
+    text = '\n'.join(lines)
+    if text.count('\n') != len(lines) - 1:
+        return [tokenize_line(line, remove_punct, lowercase) for line in lines]
+    if remove_punct:
+        text = remove_punctuation(text)
+    if lowercase:
+        text = text.lower()
+    return [line.split() for line in text.split('\n')]
+
+
+def words_to_ids(tokenized, word2idx, unknown=None, add_new_words=False):
+    # maps a list of token lists to a FlatCorpus of ids with C-level dict
+    # lookups. word2idx is a dict or a Vocab. Words not in it get `unknown`,
+    # or are dropped when it is None; with add_new_words=True they get new
+    # indices in first-seen order instead
+    lengths = np.fromiter(map(len, tokenized), dtype=np.int64, count=len(tokenized))
+    words = list(chain.from_iterable(tokenized))
+
+    if add_new_words:
+        new_words = [w for w in dict.fromkeys(words) if w not in word2idx]
+        if isinstance(word2idx, Vocab):
+            word2idx.add_words(new_words)
+        else:
+            for w in new_words:
+                word2idx[w] = len(word2idx)
+
+    if isinstance(word2idx, Vocab):
+        word2idx = word2idx.word2idx
+
+    missing = -1 if unknown is None else unknown
+    ids = np.fromiter(map(word2idx.get, words, repeat(missing)), dtype=np.int32, count=len(words))
+
+    if unknown is None and not add_new_words:
+        keep = ids >= 0
+        if not keep.all():
+            row = np.repeat(np.arange(len(lengths)), lengths)
+            lengths = np.bincount(row[keep], minlength=len(lengths))
+            ids = ids[keep]
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return FlatCorpus(ids, offsets)
+
+
+def batch_tokenize_ids(lines, word2idx, unknown=None, add_new_words=False, remove_punct=True, lowercase=True):
+    # one row of ids per line, see batch_tokenize and words_to_ids.
+    # The per-line token lists can't form reference cycles, so the cyclic gc
+    # is paused while they are built: otherwise it keeps triggering on the
+    # allocations and ends up costing as much as the tokenizing itself.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return words_to_ids(batch_tokenize(lines, remove_punct, lowercase), word2idx, unknown, add_new_words)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def limit_vocab(vocab, n_vocab):
+    # returns the small word2idx and a dense old idx -> new idx lookup table,
+    # every word that didn't make the cut maps to UNKOWN
+    small, idx_new_idx_map = vocab.limit(n_vocab)
+    for word, count in zip(small.idx2word[:-1], small.counts):
+        print(word, count)
+    return small.word2idx, idx_new_idx_map
+
+
+def remap_corpus(corpus, idx_new_idx_map):
+    # one np.take over all tokens, then drop the sentences of length <= 1
+    tokens = np.take(idx_new_idx_map, corpus.tokens)
+    return FlatCorpus(tokens, corpus.offsets).select(corpus.lengths() > 1)
+
+
+WIKI_PREFIX = '../large_files/enwiki-articles1/AB/'
+WIKI_SKIP_CHARS = ('[', '*', '-', '|', '=', '{', '}')
+
+
+def get_wikipedia_files(n_files=None, prefix=WIKI_PREFIX):
     print('prefix', os.path.exists(prefix))
 
     if not os.path.exists(prefix):
@@ -78,56 +186,123 @@ def get_wikipedia_data(n_files, n_vocab, by_paragraph=False):
         print("Please download the data from https://dumps.wikimedia.org/")
         exit()
 
-    # return variables
-
-    sentences = []
-    word2idx = {'START' : 0, 'END': 1}
-    idx2word = ['START', 'END']
-    current_idx = 2
-    word_idx_count = {0: float('inf'), 1: float('inf')}
-
     if n_files is not None:
         input_files = input_files[:n_files]
 
+    return [prefix + f for f in input_files]
+
+
+def iter_wikipedia_sentence_batches(input_files, by_paragraph=False, batch_size=10000):
+    # yields lists of raw sentence (or paragraph) strings, ready for batch_tokenize
     for f in input_files:
         print("reading", f)
-        for line in open(prefix + f, encoding='utf-8'):
+        batch = []
+        for line in open(f, encoding='utf-8'):
             line = line.strip()
 
-            if line and line[0] not in ('[', '*', '-', '|', '=', '{', '}'):
+            if line and line[0] not in WIKI_SKIP_CHARS:
                 if by_paragraph:
-                    sentence_lines = [line]
+                    batch.append(line)
                 else:
-                    sentence_lines = line.split('. ')
-                for sentence in sentence_lines:
-                    tokens = my_tokenizer(sentence)
-                    for t in tokens:
-                        if t not in word2idx:
-                            word2idx[t] = current_idx
-                            idx2word.append(t)
-                            current_idx += 1
-                        idx = word2idx[t]
-                        word_idx_count[idx] = word_idx_count.get(idx,0) + 1
-
-                    sentence_by_idx = [word2idx[t] for t in tokens]
-                    sentences.append(sentence_by_idx)
-
-    sorted_word_idx_count = sorted(word_idx_count.items(), key=operator.itemgetter(1), reverse=True)
-    word2idx_small = {}
-
-    new_idx = 0
-
-    idx_new_idx_map ={}
-    for idx, count in sorted_word_idx_count[:n_vocab]:
-        word = idx2word[idx]
-        print(word, count)
-        word2idx_small[word] = new_idx
-        idx_new_idx_map[idx] = new_idx
-        new_idx += 1
+                    batch.extend(line.split('. '))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+
+def iter_wikipedia_sentences(input_files, by_paragraph=False):
+    # yields the tokens of every sentence (or paragraph) in the given files
+    for batch in iter_wikipedia_sentence_batches(input_files, by_paragraph):
+        for tokens in batch_tokenize(batch):
+            yield tokens
+
+
+def index_wikipedia_files(input_files, by_paragraph, vocab):
+    return FlatCorpus.concatenate(
+        batch_tokenize_ids(batch, vocab, add_new_words=True)
+        for batch in iter_wikipedia_sentence_batches(input_files, by_paragraph)
+    )
+
+
+def _read_wikipedia_file(args):
+    # worker for the process pool: indexes one file against a local vocabulary.
+    # the local words are returned in first-seen order so the parent can
+    # replay them and end up with the same indices as the serial loop
+    f, by_paragraph = args
+    vocab = Vocab()
+    local_corpus = index_wikipedia_files([f], by_paragraph, vocab)
+    return list(vocab), local_corpus
+
+
+def _count_wikipedia_file(args):
+    # Counter keeps first-seen order, like the dict in the serial loop
+    f, by_paragraph = args
+    word_count = Counter()
+    for batch in iter_wikipedia_sentence_batches([f], by_paragraph):
+        word_count.update(chain.from_iterable(batch_tokenize(batch)))
+    return word_count
+
+
+def _map_wikipedia_files(func, input_files, by_paragraph, n_jobs):
+    # results always come back in the order of input_files
+    args = [(f, by_paragraph) for f in input_files]
+    if n_jobs is None:
+        n_jobs = cpu_count()
+    if n_jobs == 1:
+        for a in args:
+            yield func(a)
+    else:
+        with Pool(min(n_jobs, len(args))) as pool:
+            for result in pool.imap(func, args):
+                yield result
+
+
+def get_wikipedia_data(n_files, n_vocab, by_paragraph=False, streaming=False, n_jobs=1, flat=False, use_cache=False):
+    input_files = get_wikipedia_files(n_files)
+
+    if use_cache:
+        # streaming and n_jobs do not change the result, so they are not part of the key
+        def build():
+            return get_wikipedia_data(n_files, n_vocab, by_paragraph, streaming, n_jobs, flat=True)
+        params = [n_files, n_vocab, by_paragraph]
+        return cached_corpus('wikipedia', params, input_files, build, flat)
+
+    if streaming:
+        return get_wikipedia_data_streaming(input_files, n_vocab, by_paragraph, n_jobs, flat)
+
+    # return variables
 
-    word2idx_small['UNKOWN'] = new_idx
-    unknown = new_idx
+    vocab = Vocab(['START', 'END'])
 
+    if n_jobs == 1:
+        corpus = index_wikipedia_files(input_files, by_paragraph, vocab)
+    else:
+        # merge the per-file results in file order, so new words get the
+        # same indices (and the same count ties) as in the serial loop
+        results = _map_wikipedia_files(_read_wikipedia_file, input_files, by_paragraph, n_jobs)
+        local_corpora = []
+        for words, local_corpus in results:
+            local2global = np.array(vocab.add_words(words), dtype=np.int32)
+            local_corpora.append(FlatCorpus(local2global[local_corpus.tokens], local_corpus.offsets))
+        corpus = FlatCorpus.concatenate(local_corpora)
+
+    vocab.count_tokens(corpus.tokens)
+    vocab.pin(['START', 'END'])
+
+    word2idx_small, idx_new_idx_map = limit_vocab(vocab, n_vocab)
+
+    check_wikipedia_vocab(word2idx_small)
+
+    sentence_small = remap_corpus(corpus, idx_new_idx_map)
+    if flat:
+        return sentence_small, word2idx_small
+
+    return sentence_small.tolist(), word2idx_small
+
+
+def check_wikipedia_vocab(word2idx_small):
     assert('START' in word2idx_small)
     assert('END' in word2idx_small)
     assert('king' in word2idx_small)
@@ -135,13 +310,38 @@ def get_wikipedia_data(n_files, n_vocab, by_paragraph=False):
     assert('man' in word2idx_small)
     assert('woman' in word2idx_small)
 
-    sentence_small = []
-    for sentence in sentences:
-        if len(sentence) > 1:
-            new_sentence = [idx_new_idx_map[idx] if idx in idx_new_idx_map else unknown for idx in sentence]
-            sentence_small.append(new_sentence)
 
-    return sentence_small, word2idx_small
+def get_wikipedia_data_streaming(input_files, n_vocab, by_paragraph=False, n_jobs=1, flat=False):
+    # two passes over the files: the first one only counts words, the second
+    # one is a generator that re-reads the files and yields the remapped
+    # sentences, so memory grows with the vocabulary and not with the corpus.
+    # the vocab keeps first-seen order, so ties are broken exactly like the
+    # in-memory version does.
+    vocab = Vocab(['START', 'END'])
+    for file_count in _map_wikipedia_files(_count_wikipedia_file, input_files, by_paragraph, n_jobs):
+        vocab.add_words(list(file_count), list(file_count.values()))
+    vocab.pin(['START', 'END'])
+
+    word2idx_small, _ = limit_vocab(vocab, n_vocab)
+
+    check_wikipedia_vocab(word2idx_small)
+
+    def sentence_small_batches():
+        unknown = word2idx_small['UNKOWN']
+        for batch in iter_wikipedia_sentence_batches(input_files, by_paragraph):
+            ids = batch_tokenize_ids(batch, word2idx_small, unknown=unknown)
+            yield ids.select(ids.lengths() > 1)
+
+    def sentence_small():
+        for batch in sentence_small_batches():
+            for sentence in batch.tolist():
+                yield sentence
+
+    if flat:
+        # the second pass goes straight into the flat arrays
+        return FlatCorpus.concatenate(sentence_small_batches()), word2idx_small
+
+    return sentence_small(), word2idx_small
 
 KEEP_WORDS = set([
     'king', 'man', 'queen', 'woman',
@@ -157,83 +357,52 @@ def get_sentences():
 
 def get_sentences_with_word2idx():
     sentences = get_sentences()
-    indexed_sentences = []
-
-    i = 2
-    word2idx = {'START': 0, 'END': 1}
-    for sentence in sentences:
-        indexed_sentence = []
-        for token in sentence:
-            token = token.lower()
-            if token not in word2idx:
-                word2idx[token] = i
-                i +=1
-            indexed_sentence.append(word2idx[token])
-        indexed_sentences.append(indexed_sentence)
-    print("Vocab size: ", i)
-    return indexed_sentences, word2idx
-
-def get_sentences_with_word2idx_limit_vocab(n_vocab=2000, keep_words=KEEP_WORDS):
-    sentences = get_sentences()
-    indexed_sentences = []
 
-    i = 2
-    word2idx = {'START': 0, 'END': 1}
-    idx2word = ['START', 'END']
+    vocab = Vocab(['START', 'END'])
+    indexed_sentences = words_to_ids(
+        [[token.lower() for token in sentence] for sentence in sentences], vocab, add_new_words=True
+    )
+    print("Vocab size: ", len(vocab))
+    return indexed_sentences.tolist(), vocab.word2idx
 
-    word_idx_count = {
-        0: float('inf'),
-        1: float('inf')
-    }
+def get_brown_files():
+    # the files behind brown.sents(), used to fingerprint the corpus cache
+    if hasattr(brown.root, 'zipfile'):
+        return [brown.root.zipfile.filename]
+    return [brown.abspath(f).path for f in brown.fileids()]
 
-    for sentence in sentences:
-        indexed_sentence = []
-        for token in sentence:
-            token = token.lower()
-            if token not in word2idx:
-                idx2word.append(token)
-                word2idx[token] = i
-                i += 1
 
-            idx = word2idx[token]
-            word_idx_count[idx] = word_idx_count.get(idx, 0) +1
+def get_sentences_with_word2idx_limit_vocab(n_vocab=2000, keep_words=KEEP_WORDS, flat=False, use_cache=False):
+    if use_cache:
+        def build():
+            return get_sentences_with_word2idx_limit_vocab(n_vocab, keep_words, flat=True)
+        params = [n_vocab, sorted(keep_words)]
+        return cached_corpus('brown_limit_vocab', params, get_brown_files(), build, flat)
 
-            indexed_sentence.append(idx)
-        indexed_sentences.append(indexed_sentence)
-
-    # restrict vocab size
-    for word in keep_words:
-        word_idx_count[word2idx[word]] = float('inf')
+    sentences = get_sentences()
 
-    sorted_word_idx_count = sorted(word_idx_count.items(), key=operator.itemgetter(1), reverse=True)
-    word2idx_small = {}
-    new_idx = 0
+    vocab = Vocab(['START', 'END'])
+    corpus = words_to_ids(
+        [[token.lower() for token in sentence] for sentence in sentences], vocab, add_new_words=True
+    )
+    vocab.count_tokens(corpus.tokens)
 
-    idx_new_idx_map = {}
-    for idx, count in sorted_word_idx_count[:n_vocab]:
-        word = idx2word[idx]
-        print(word, count)
-        word2idx_small[word] = new_idx
-        idx_new_idx_map[idx] = new_idx
-        new_idx += 1
+    # restrict vocab size
+    vocab.pin(['START', 'END'])
+    vocab.pin(keep_words)
 
-    word2idx_small['UNKOWN'] = new_idx
-    unknown = new_idx
+    word2idx_small, idx_new_idx_map = limit_vocab(vocab, n_vocab)
 
     assert('START' in word2idx_small)
     assert('END' in word2idx_small)
     for word in keep_words:
         assert(word in word2idx_small)
 
-    sentence_small = []
-    for sentence in indexed_sentences:
-        if len(sentence) > 1:
-            new_sentence = [idx_new_idx_map[idx] if idx in idx_new_idx_map else unknown for idx in sentence]
-            sentence_small.append(new_sentence)
-    return sentence_small, word2idx_small
+    sentence_small = remap_corpus(corpus, idx_new_idx_map)
+    if flat:
+        return sentence_small, word2idx_small
+    return sentence_small.tolist(), word2idx_small
 
 
 def init_weight(Mi, Mo):
     return np.random.randn(Mi, Mo) / np.sqrt(Mi + Mo)
-
-
@@ -0,0 +1,143 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from vocab import Vocab
+from similarity_index import SimilarityIndex
+from nlp_util import find_analogies
+from cooccurrence import load_cooccurrence, cooccurrence_for_source, raw_to_npy
+
+# Word vectors without iterative training (Levy, Goldberg & Dagan 2015):
+#   PPMI_ij = max(0, log(X_ij / (X_i* P_a(j)))),  P_a(j) = X_*j^0.75 / sum_k X_*k^0.75
+# (context distribution smoothing), factorized with a
+# randomized truncated SVD (Halko, Martinsson & Tropp 2011), vectors U * S^0.5.
+#
+# Both steps run over the CSR matrix in blocks of rows read from the
+# memory-mapped files, so memory is a few (V, D + oversampling) dense
+# matrices plus one block: no V x V array and no full copy of the matrix.
+
+
+def iter_row_blocks(indptr, indices, data, block_rows=10000):
+    # (first row, CSR block) over the memory-mapped arrays
+    V = len(indptr) - 1
+    for start in range(0, V, block_rows):
+        end = min(start + block_rows, V)
+        a, b = indptr[start], indptr[end]
+        block = csr_matrix(
+            (np.asarray(data[a:b]), np.asarray(indices[a:b]), indptr[start:end+1] - a),
+            shape=(end - start, V),
+        )
+        yield start, block
+
+
+def build_ppmi(prefix, cds=0.75, block_rows=10000):
+    # writes <prefix>_ppmi_{indptr,indices,data}.npy, only the positive entries
+    indptr, indices, data = load_cooccurrence(prefix)
+    V = len(indptr) - 1
+    row_sums = np.zeros(V)
+    col_sums = np.zeros(V)
+    for start, block in iter_row_blocks(indptr, indices, data, block_rows):
+        row_sums[start:start+block.shape[0]] = np.asarray(block.sum(axis=1)).ravel()
+        col_sums += np.bincount(block.indices, weights=block.data, minlength=V)
+    context_p = col_sums ** cds
+    context_p /= context_p.sum()
+
+    row_counts = np.zeros(V, dtype=np.int64)
+    with open(prefix + '_ppmi_indices.tmp', 'wb') as f_indices, open(prefix + '_ppmi_data.tmp', 'wb') as f_data:
+        for start, block in iter_row_blocks(indptr, indices, data, block_rows):
+            rows = np.repeat(np.arange(start, start + block.shape[0]), np.diff(block.indptr))
+            pmi = np.log(block.data / (row_sums[rows] * context_p[block.indices]))
+            keep = pmi > 0
+            row_counts[start:start+block.shape[0]] = np.bincount(rows[keep] - start, minlength=block.shape[0])
+            f_indices.write(block.indices[keep].astype(np.int32).tobytes())
+            f_data.write(pmi[keep].astype(np.float32).tobytes())
+
+    ppmi_indptr = np.zeros(V + 1, dtype=np.int64)
+    np.cumsum(row_counts, out=ppmi_indptr[1:])
+    for name, dtype in (('indices', np.int32), ('data', np.float32)):
+        raw_to_npy(prefix + '_ppmi_%s.tmp' % name, prefix + '_ppmi_%s.npy' % name, dtype)
+    np.save(prefix + '_ppmi_indptr.npy', ppmi_indptr)
+    print("PPMI: %d of %d entries positive" % (ppmi_indptr[-1], indptr[-1]))
+
+
+def load_ppmi(prefix):
+    return (
+        np.load(prefix + '_ppmi_indptr.npy'),
+        np.load(prefix + '_ppmi_indices.npy', mmap_mode='r'),
+        np.load(prefix + '_ppmi_data.npy', mmap_mode='r'),
+    )
+
+
+def blocked_dot(matrix, X, block_rows):
+    # A.dot(X), one block of rows of A at a time
+    out = np.zeros((len(matrix[0]) - 1, X.shape[1]), dtype=np.float32)
+    for start, block in iter_row_blocks(*matrix, block_rows=block_rows):
+        out[start:start+block.shape[0]] = block.dot(X)
+    return out
+
+
+def blocked_tdot(matrix, X, block_rows):
+    # A.T.dot(X), summed over the blocks of rows of A
+    out = np.zeros((len(matrix[0]) - 1, X.shape[1]), dtype=np.float32)
+    for start, block in iter_row_blocks(*matrix, block_rows=block_rows):
+        out += block.T.dot(X[start:start+block.shape[0]])
+    return out
+
+
+def randomized_svd(matrix, k, n_oversamples=10, n_iter=4, block_rows=10000, seed=0):
+    # matrix: (indptr, indices, data) of a square CSR matrix. returns U, S
+    rng = np.random.RandomState(seed)
+    V = len(matrix[0]) - 1
+    l = min(k + n_oversamples, V)
+
+    Q = blocked_dot(matrix, rng.normal(size=(V, l)).astype(np.float32), block_rows)
+    Q, _ = np.linalg.qr(Q)
+    for it in range(n_iter):
+        # power iterations, re-orthonormalized every half step for stability
+        Q, _ = np.linalg.qr(blocked_tdot(matrix, Q, block_rows))
+        Q, _ = np.linalg.qr(blocked_dot(matrix, Q, block_rows))
+
+    # B = Q^T A is small (l, V)
+    B = blocked_tdot(matrix, Q, block_rows).T
+    Ub, S, _ = np.linalg.svd(B, full_matrices=False)
+    return Q.dot(Ub[:, :k]), S[:k]
+
+
+def ppmi_svd_embedding(prefix, D=100, eig=0.5, block_rows=10000):
+    t0 = datetime.now()
+    ppmi = prefix + '_ppmi_indptr.npy'
+    if not os.path.exists(ppmi) or os.path.getmtime(ppmi) < os.path.getmtime(prefix + '_cooc_indptr.npy'):
+        build_ppmi(prefix, block_rows=block_rows)
+        print("built PPMI in %s" % (datetime.now() - t0))
+    t0 = datetime.now()
+    U, S = randomized_svd(load_ppmi(prefix), D, block_rows=block_rows)
+    print("randomized SVD to %d dimensions in %s" % (D, datetime.now() - t0))
+    return U * S ** eig
+
+
+if __name__ == '__main__':
+    # usage: python ppmi_svd.py [brown|wiki] [n vocab] [D]
+    source = sys.argv[1] if len(sys.argv) > 1 else 'brown'
+    n_vocab = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    D = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    prefix = cooccurrence_for_source(source, n_vocab)
+    We = ppmi_svd_embedding(prefix, D)
+
+    # same layout as embedding_store, load it back with load_embeddings
+    vocab = Vocab.load(prefix)
+    np.save(prefix + '_ppmi_svd_%d_vectors.npy' % D, We)
+    vocab.save(prefix + '_ppmi_svd_%d' % D)
+
+    word2idx = vocab.word2idx
+    idx2word = vocab.idx2word
+    index = SimilarityIndex(We)
+    for w1, w2, w3 in (('king', 'man', 'woman'), ('france', 'paris', 'london'), ('man', 'woman', 'he')):
+        if all(w in word2idx for w in (w1, w2, w3)):
+            find_analogies(w1, w2, w3, We, word2idx, idx2word, index)
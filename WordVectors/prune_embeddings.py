@@ -0,0 +1,133 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from vocab import Vocab
+from nlp_util import batch_tokenize
+from embedding_store import parse_glove_line, load_embeddings
+from word2vec_bin import Word2VecBin
+
+# Export only the vectors of the words a corpus actually uses. The result is
+# the binary store of embedding_store.py (<prefix>_vectors.npy + Vocab files,
+# load it with load_embeddings(prefix)), with the corpus counts as the vocab
+# counts, plus a coverage report in <prefix>_coverage.txt.
+#
+# The corpus is read with the vectorizers' tokenization: split on whitespace,
+# no punctuation removal, lowercased for GloVe and case kept for word2vec.
+# Lines of a label<TAB>text file (R8) only count the text.
+
+
+def count_corpus_words(paths, lowercase=True, batch_size=10000):
+    counts = Counter()
+    for path in paths:
+        batch = []
+        for line in open(path, encoding='utf-8'):
+            batch.append(line.rstrip('\n').split('\t', 1)[-1])
+            if len(batch) == batch_size:
+                for tokens in batch_tokenize(batch, remove_punct=False, lowercase=lowercase):
+                    counts.update(tokens)
+                batch = []
+        for tokens in batch_tokenize(batch, remove_punct=False, lowercase=lowercase):
+            counts.update(tokens)
+    return counts
+
+
+def prune_glove_txt(txt_path, words):
+    # streams the text file once, returns the kept words (file order) and rows
+    kept = []
+    rows = []
+    seen = set()
+    D = None
+    n_rows = 0
+    with open(txt_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            n_rows += 1
+            word, values = parse_glove_line(line, D)
+            D = len(values)
+            if word in words and word not in seen:
+                seen.add(word)
+                kept.append(word)
+                rows.append(np.asarray(values, dtype=np.float32))
+    return kept, np.array(rows, dtype=np.float32).reshape(-1, D or 0), n_rows
+
+
+def prune_word2vec_bin(bin_path, words):
+    # only the rows of the kept words are read, through the .bin offset index
+    w2v = Word2VecBin(bin_path)
+    found = sorted((w2v.index_of(w), w) for w in words if w in w2v)
+    kept = [w for _, w in found]
+    rows = w2v.read_rows([i for i, _ in found])
+    n_rows = len(w2v)
+    w2v.close()
+    return kept, rows, n_rows
+
+
+def coverage_report(counts, kept, n_rows, D, top_missing=30):
+    kept_set = set(kept)
+    n_tokens = sum(counts.values())
+    covered_tokens = sum(c for w, c in counts.items() if w in kept_set)
+    missing = [(w, c) for w, c in counts.most_common() if w not in kept_set][:top_missing]
+
+    lines = [
+        "corpus: %d distinct words, %d tokens" % (len(counts), n_tokens),
+        "word coverage: %d / %d (%.2f%%)" % (len(kept), len(counts), 100 * len(kept) / max(len(counts), 1)),
+        "token coverage: %d / %d (%.2f%%)" % (covered_tokens, n_tokens, 100 * covered_tokens / max(n_tokens, 1)),
+        "rows: %d of %d kept (%.2f%%), %.1f MB instead of %.1f MB" % (
+            len(kept), n_rows, 100 * len(kept) / max(n_rows, 1), len(kept) * D * 4 / 1e6, n_rows * D * 4 / 1e6),
+        "most frequent missing words:",
+    ]
+    lines.extend("\t%s\t%d" % (w, c) for w, c in missing)
+    return '\n'.join(lines)
+
+
+def prune_embeddings(vectors_path, corpus_paths, prefix, lowercase=None):
+    # vectors_path: a GloVe .txt or word2vec .bin file. lowercase defaults to
+    # True for GloVe (lowercased vocabulary) and False for word2vec
+    t0 = datetime.now()
+    is_bin = vectors_path.endswith('.bin')
+    if lowercase is None:
+        lowercase = not is_bin
+
+    counts = count_corpus_words(corpus_paths, lowercase)
+    print("counted %d distinct words in %s" % (len(counts), datetime.now() - t0))
+
+    if is_bin:
+        kept, rows, n_rows = prune_word2vec_bin(vectors_path, counts)
+    else:
+        kept, rows, n_rows = prune_glove_txt(vectors_path, counts)
+
+    np.save(prefix + '_vectors.npy', rows)
+    # the vocab files go last, their presence marks a complete store
+    Vocab(kept, [counts[w] for w in kept]).save(prefix)
+
+    report = coverage_report(counts, kept, n_rows, rows.shape[1])
+    with open(prefix + '_coverage.txt', 'w', encoding='utf-8') as f:
+        f.write(report + '\n')
+    print(report)
+    print("pruned store written to %s_* in %s" % (prefix, datetime.now() - t0))
+
+
+if __name__ == '__main__':
+    # usage: python prune_embeddings.py <glove txt or word2vec bin> <output prefix> <corpus file>...
+    # e.g. python prune_embeddings.py ../large_files/glove.6B/glove.6B.50d.txt ../large_files/r8_glove50 \
+    #          ../large_files/r8-train-all-terms.txt ../large_files/r8-test-all-terms.txt
+    if len(sys.argv) < 4:
+        print("usage: python prune_embeddings.py <glove txt or word2vec bin> <output prefix> <corpus file>...")
+        exit()
+    vectors_path, prefix, corpus_paths = sys.argv[1], sys.argv[2], sys.argv[3:]
+    out_dir = os.path.dirname(prefix)
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    prune_embeddings(vectors_path, corpus_paths, prefix)
+
+    t0 = datetime.now()
+    embedding, vocab = load_embeddings(prefix)
+    print("loaded %d x %d in %s" % (embedding.shape[0], embedding.shape[1], datetime.now() - t0))
@@ -0,0 +1,198 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+# Quantized embedding storage with cosine top-k search run directly on the
+# quantized rows:
+#   float16: half the memory of float32, recall is practically exact
+#   int8:    a quarter of the memory, every row scaled by max(|row|) / 127
+#   float32: no quantization, the exact baseline
+# Rows are stored as-is (not normalized) so rows() still returns usable
+# vectors for mean pooling; 1 / norm is kept per row for the cosine.
+# Scoring goes through the matrix in blocks of rows converted to float32,
+# so the full float32 matrix never exists in memory.
+
+KINDS = ('float32', 'float16', 'int8')
+
+
+class QuantizedEmbedding:
+    def __init__(self, kind, data, scales, inv_norms):
+        self.kind = kind
+        self.data = data
+        self.scales = scales
+        self.inv_norms = inv_norms
+        self.V, self.D = data.shape
+
+    @classmethod
+    def quantize(cls, embedding, kind='int8', block_rows=65536):
+        if kind not in KINDS:
+            raise ValueError("unknown kind: %s" % kind)
+        V, D = embedding.shape
+        if kind == 'float32':
+            data = np.asarray(embedding, dtype=np.float32)
+        else:
+            data = np.zeros((V, D), dtype=kind)
+        scales = np.ones(V, dtype=np.float32)
+        inv_norms = np.zeros(V, dtype=np.float32)
+
+        for start in range(0, V, block_rows):
+            block = np.asarray(embedding[start:start+block_rows], dtype=np.float32)
+            norms = np.linalg.norm(block, axis=1)
+            inv_norms[start:start+block_rows] = np.where(norms > 0, 1 / np.maximum(norms, 1e-30), 0)
+            if kind == 'float16':
+                data[start:start+block_rows] = block
+            elif kind == 'int8':
+                scale = np.abs(block).max(axis=1) / 127
+                scale[scale == 0] = 1
+                data[start:start+block_rows] = np.rint(block / scale[:, None])
+                scales[start:start+block_rows] = scale
+        return cls(kind, data, scales, inv_norms)
+
+    def nbytes(self):
+        return self.data.nbytes + self.scales.nbytes + self.inv_norms.nbytes
+
+    def rows(self, idxs):
+        # dequantized float32 rows
+        return self.data[idxs].astype(np.float32) * self.scales[idxs, None]
+
+    def top_k_batch(self, Q, k=10, exclude=None, rerank=None, n_candidates=None, block_rows=65536):
+        # cosine top-k for every row of Q. Each block of rows is scored with
+        # one matmul and merged into the running top-k, so memory stays at
+        # (B, block_rows) scores. exclude: optional list of index lists.
+        # rerank: a float32 (V, D) matrix (e.g. the memory-mapped store); the
+        # n_candidates best quantized hits (default 4k) are re-scored exactly
+        # with it, which only reads those rows
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        q_norms = np.linalg.norm(Q, axis=1, keepdims=True)
+        q_norms[q_norms == 0] = 1
+        Q = Q / q_norms
+
+        if rerank is not None:
+            n_candidates = n_candidates or 4 * k
+            cand, _ = self.top_k_batch(Q, n_candidates, exclude, block_rows=block_rows)
+            # -1 pads rows with fewer candidates (drop_excluded), they are not
+            # read and never win. every other row is read once, in sorted order
+            valid = cand >= 0
+            ids, inverse = np.unique(cand[valid], return_inverse=True)
+            rows = np.zeros(cand.shape + (self.D,), dtype=np.float32)
+            rows[valid] = np.asarray(rerank[ids], dtype=np.float32)[inverse]
+            norms = np.linalg.norm(rows, axis=2)
+            scores = np.einsum('bcd,bd->bc', rows, Q) / np.maximum(norms, 1e-30)
+            scores[~valid] = -np.inf
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+            return np.take_along_axis(cand, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+        n_excluded = max([len(e) for e in exclude]) if exclude is not None and len(exclude) else 0
+        kk = min(k + n_excluded, self.V)
+        best_idx = np.zeros((len(Q), 0), dtype=np.int64)
+        best_scores = np.zeros((len(Q), 0), dtype=np.float32)
+
+        for start in range(0, self.V, block_rows):
+            block = np.asarray(self.data[start:start+block_rows], dtype=np.float32)
+            factors = self.scales[start:start+block_rows] * self.inv_norms[start:start+block_rows]
+            scores = Q.dot(block.T) * factors
+
+            n = min(kk, scores.shape[1])
+            idx = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+            best_idx = np.concatenate([best_idx, idx + start], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, idx, axis=1)], axis=1)
+            if best_idx.shape[1] > kk:
+                keep = np.argpartition(-best_scores, kk - 1, axis=1)[:, :kk]
+                best_idx = np.take_along_axis(best_idx, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        if exclude is not None:
+            return drop_excluded(best_idx, best_scores, exclude, k)
+        return best_idx[:, :k], best_scores[:, :k]
+
+    def top_k(self, v, k=10, exclude=(), rerank=None, n_candidates=None):
+        idx, scores = self.top_k_batch(v, k, [list(exclude)], rerank, n_candidates)
+        return idx[0], scores[0]
+
+    def save(self, prefix):
+        np.save('%s_%s.npy' % (prefix, self.kind), self.data)
+        np.save('%s_%s_scales.npy' % (prefix, self.kind), self.scales)
+        np.save('%s_%s_inv_norms.npy' % (prefix, self.kind), self.inv_norms)
+
+    @classmethod
+    def load(cls, prefix, kind='int8', mmap_mode='r'):
+        return cls(
+            kind,
+            np.load('%s_%s.npy' % (prefix, kind), mmap_mode=mmap_mode),
+            np.load('%s_%s_scales.npy' % (prefix, kind)),
+            np.load('%s_%s_inv_norms.npy' % (prefix, kind)),
+        )
+
+
+def drop_excluded(idx, scores, exclude, k):
+    # rows left with fewer than k hits are padded with index -1, score -inf
+    out_idx = np.full((len(idx), k), -1, dtype=np.int64)
+    out_scores = np.full((len(idx), k), -np.inf, dtype=np.float32)
+    for i in range(len(idx)):
+        keep = ~np.isin(idx[i], exclude[i])
+        n = min(k, keep.sum())
+        out_idx[i, :n] = idx[i][keep][:n]
+        out_scores[i, :n] = scores[i][keep][:n]
+    return out_idx, out_scores
+
+
+def recall_report(embedding, queries, k=10, rerank_candidates=(0, 2, 4), kinds=('float16', 'int8')):
+    # recall@k of every setting against the exact float32 top-k (the same
+    # ranking as gensim's most_similar(positive=[word])), plus memory and
+    # latency per query. The query word itself is excluded, like most_similar
+    exact = QuantizedEmbedding.quantize(embedding, 'float32')
+    Q = np.asarray(embedding[queries], dtype=np.float32)
+    exclude = [[q] for q in queries]
+
+    t0 = datetime.now()
+    truth, _ = exact.top_k_batch(Q, k, exclude)
+    exact_ms = (datetime.now() - t0).total_seconds() * 1000 / len(queries)
+
+    print("%-8s %-8s %10s %10s %12s" % ('kind', 'rerank', 'recall@%d' % k, 'MB', 'ms/query'))
+    print("%-8s %-8s %10.4f %10.1f %12.3f" % ('float32', '-', 1.0, exact.nbytes() / 1e6, exact_ms))
+    results = {}
+    for kind in kinds:
+        store = QuantizedEmbedding.quantize(embedding, kind)
+        for factor in rerank_candidates:
+            t0 = datetime.now()
+            if factor:
+                found, _ = store.top_k_batch(Q, k, exclude, rerank=embedding, n_candidates=factor * k)
+            else:
+                found, _ = store.top_k_batch(Q, k, exclude)
+            ms = (datetime.now() - t0).total_seconds() * 1000 / len(queries)
+            recall = np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+            results[(kind, factor)] = recall
+            print("%-8s %-8s %10.4f %10.1f %12.3f" % (kind, '%dk' % factor if factor else '-', recall, store.nbytes() / 1e6, ms))
+    return results
+
+
+if __name__ == '__main__':
+    # usage: python quantized_store.py [glove txt or word2vec bin] [n queries]
+    path = sys.argv[1] if len(sys.argv) > 1 else '../large_files/GoogleNews-vectors-negative300.bin'
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print("Loading word vectors...")
+    if path.endswith('.bin'):
+        from gensim.models import KeyedVectors
+        embedding = KeyedVectors.load_word2vec_format(path, binary=True).vectors
+    else:
+        from embedding_store import load_glove
+        embedding, _ = load_glove(path)
+
+    # queries come from the 100k most frequent words, the ones asked about most
+    np.random.seed(0)
+    queries = np.random.choice(min(100000, len(embedding)), n_queries, replace=False)
+    recall_report(embedding, queries)
+
+    prefix = os.path.splitext(path)[0]
+    for kind in ('float16', 'int8'):
+        QuantizedEmbedding.quantize(embedding, kind).save(prefix)
+        print("saved", '%s_%s.npy' % (prefix, kind))
@@ -0,0 +1,64 @@
+from __future__ import print_function, division
+
+from collections import OrderedDict
+
+
+# Bounded LRU memo for query results. Neighbor and analogy traffic is skewed
+# towards a few thousand words, so a small cache answers most queries.
+# The owner passes its current version on every call; a different version
+# (e.g. the embedding matrix was replaced) drops everything cached so far.
+class LRUCache:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.data:
+                self.invalidations += 1
+                self.data.clear()
+            self.version = version
+
+    def get(self, key, version=None):
+        # returns None on a miss
+        self._check_version(version)
+        value = self.data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, version=None):
+        if self.maxsize <= 0:
+            return
+        self._check_version(version)
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
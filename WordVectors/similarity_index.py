@@ -0,0 +1,110 @@
+from __future__ import print_function, division
+from builtins import range
+
+import numpy as np
+
+from query_cache import LRUCache
+
+# Top-k search over an embedding matrix. Rows are L2-normalized once here, so
+# a query is one BLAS matvec (or matmul for a batch) plus an argpartition:
+# O(V*D + V + k log k) instead of pairwise_distances followed by a full argsort.
+# nearest_neighbors() and analogy() results are memoized in a bounded LRU
+# cache (cache_size=0 turns it off); set_embedding() invalidates it.
+class SimilarityIndex:
+    def __init__(self, embedding, cache_size=10000):
+        self.version = 0
+        self.cache = LRUCache(cache_size)
+        self.set_embedding(embedding)
+
+    def set_embedding(self, embedding):
+        # the only supported way to change the vectors: cached results
+        # computed from the old matrix are dropped. a writeable float32
+        # matrix of the caller is copied, so that changing it in place
+        # afterwards (a trainer updating W) can't leave normed and the cache
+        # stale; call set_embedding again to pick the changes up. read-only
+        # ones (memory-mapped stores) are shared as they are, and other
+        # dtypes are already a new array after the conversion
+        W = np.asarray(embedding, dtype=np.float32)
+        if W.flags.writeable and np.shares_memory(W, embedding):
+            W = W.copy()
+        self.embedding = W
+        self.V, self.D = self.embedding.shape
+
+        norms = np.linalg.norm(self.embedding, axis=1)
+        norms[norms == 0] = 1
+        self.normed = self.embedding / norms[:, None]
+        self.sq_norms = (self.embedding ** 2).sum(axis=1)
+        self.version += 1
+
+    def scores(self, Q, metric='cosine'):
+        # Q is (D,) or (B, D). Higher is better for both metrics:
+        #   cosine: cosine similarity
+        #   euclidean: minus the squared distance
+        Q = np.asarray(Q, dtype=np.float32)
+        if metric == 'cosine':
+            q_norms = np.linalg.norm(Q, axis=-1, keepdims=True)
+            q_norms[q_norms == 0] = 1
+            return (Q / q_norms).dot(self.normed.T)
+        elif metric == 'euclidean':
+            q_sq = (Q ** 2).sum(axis=-1, keepdims=True)
+            return 2 * Q.dot(self.embedding.T) - self.sq_norms - q_sq
+        raise ValueError("unknown metric: %s" % metric)
+
+    def top_k(self, v, k=1, exclude=(), metric='cosine'):
+        # returns (indices, scores) of the k best rows for one query vector,
+        # best first. rows in exclude (e.g. the query words) are never returned
+        scores = self.scores(v, metric)
+        exclude = list(exclude)
+        if exclude:
+            scores[exclude] = -np.inf
+        return select_top_k(scores, min(k, self.V - len(set(exclude))))
+
+    def top_k_batch(self, Q, k=1, exclude=None, metric='cosine'):
+        # same as top_k for every row of Q with a single matmul.
+        # exclude is an optional (B, m) int array of rows to skip per query
+        scores = self.scores(Q, metric)
+        if exclude is not None and len(exclude):
+            np.put_along_axis(scores, np.asarray(exclude), -np.inf, axis=1)
+        return select_top_k(scores, k)
+
+    def _cached(self, key, compute):
+        result = self.cache.get(key, self.version)
+        if result is None:
+            result = compute()
+            for a in result:
+                # shared between callers from now on
+                a.setflags(write=False)
+            self.cache.put(key, result, self.version)
+        return result
+
+    def nearest_neighbors(self, idx, k=5, metric='cosine'):
+        idx = int(idx)
+        return self._cached(
+            ('neighbors', idx, k, metric),
+            lambda: self.top_k(self.embedding[idx], k, exclude=[idx], metric=metric),
+        )
+
+    def analogy(self, positive, negative, k=1, metric='cosine'):
+        # top k for sum(positive) - sum(negative), the input rows excluded,
+        # e.g. analogy([king, woman], [man]) for king - man + woman
+        positive = tuple(int(i) for i in positive)
+        negative = tuple(int(i) for i in negative)
+
+        def compute():
+            v = self.embedding[list(positive)].sum(axis=0) - self.embedding[list(negative)].sum(axis=0)
+            return self.top_k(v, k, exclude=positive + negative, metric=metric)
+
+        return self._cached(('analogy', positive, negative, k, metric), compute)
+
+
+def select_top_k(scores, k):
+    # argpartition picks the k largest along the last axis in O(V),
+    # only those k are then sorted
+    k = max(0, min(k, scores.shape[-1]))
+    if k == 0:
+        idx = np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+        return idx, np.zeros(idx.shape, dtype=scores.dtype)
+    idx = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    top_scores = np.take_along_axis(scores, idx, axis=-1)
+    order = np.argsort(-top_scores, axis=-1, kind='stable')
+    return np.take_along_axis(idx, order, axis=-1), np.take_along_axis(top_scores, order, axis=-1)
@@ -0,0 +1,107 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from embedding_store import count_lines
+
+# Out-of-core document classification: a label<TAB>text file is read in
+# chunks, every chunk is featurized by a vectorizer (anything with
+# .transform(list of str), e.g. GloveVectorizer / Word2VecVectorizer) and
+# written into a disk-backed float32 memmap:
+#   <prefix>_X.npy   (N, D) float32 features
+#   <prefix>_y.npy   (N,) int32 label ids, into the classes list
+# A classifier with partial_fit (e.g. SGDClassifier) is then trained and
+# scored over the memmap one chunk at a time, so peak memory stays at one
+# chunk of text plus one chunk of features however big the corpus is.
+
+
+def iter_tsv_chunks(path, chunk_size=10000):
+    # yields (labels, texts) lists of at most chunk_size documents
+    reader = pd.read_csv(path, header=None, sep='\t', names=['label', 'content'],
+                         chunksize=chunk_size, keep_default_na=False)
+    for chunk in reader:
+        yield chunk.label.tolist(), chunk.content.tolist()
+
+
+def featurize_tsv(path, vectorizer, prefix, classes=None, chunk_size=10000):
+    # returns the memory-mapped X, y and the classes. pass the classes of the
+    # train set when featurizing the test set, so label ids line up; a label
+    # not seen before is appended to the list
+    t0 = datetime.now()
+    classes = list(classes or [])
+    class_idx = dict((c, i) for i, c in enumerate(classes))
+    N = count_lines(path)
+
+    X = None
+    y = np.lib.format.open_memmap(prefix + '_y.npy', mode='w+', dtype=np.int32, shape=(N,))
+    n = 0
+    for labels, texts in iter_tsv_chunks(path, chunk_size):
+        features = np.asarray(vectorizer.transform(texts), dtype=np.float32)
+        if X is None:
+            X = np.lib.format.open_memmap(prefix + '_X.npy', mode='w+', dtype=np.float32, shape=(N, features.shape[1]))
+        X[n:n+len(texts)] = features
+        for label in labels:
+            if label not in class_idx:
+                class_idx[label] = len(classes)
+                classes.append(label)
+        y[n:n+len(texts)] = [class_idx[label] for label in labels]
+        n += len(texts)
+        print("featurized %d / ~%d documents" % (n, N))
+
+    if X is None:
+        raise ValueError("no documents in %s" % path)
+    X.flush()
+    y.flush()
+    print("featurized %s in %s" % (path, datetime.now() - t0))
+    # the line count is an upper bound (blank lines), only n rows were written
+    return X[:n], y[:n], classes
+
+
+def load_features(prefix):
+    return np.load(prefix + '_X.npy', mmap_mode='r'), np.load(prefix + '_y.npy', mmap_mode='r')
+
+
+def train_incremental(model, X, y, classes, n_epochs=5, chunk_size=10000, seed=0):
+    # partial_fit over the memmap in chunks, the chunk order is shuffled
+    # every epoch (the rows inside a chunk stay contiguous on disk)
+    rng = np.random.RandomState(seed)
+    all_classes = np.arange(len(classes))
+    starts = np.arange(0, len(X), chunk_size)
+    for epoch in range(n_epochs):
+        t0 = datetime.now()
+        for start in rng.permutation(starts):
+            Xc = np.asarray(X[start:start+chunk_size])
+            yc = np.asarray(y[start:start+chunk_size])
+            model.partial_fit(Xc, yc, classes=all_classes)
+        print("epoch %d done in %s" % (epoch, datetime.now() - t0))
+    return model
+
+
+def score_chunked(model, X, y, chunk_size=10000):
+    correct = 0
+    for start in range(0, len(X), chunk_size):
+        correct += (model.predict(np.asarray(X[start:start+chunk_size])) == np.asarray(y[start:start+chunk_size])).sum()
+    return correct / len(X) if len(X) else 0.0
+
+
+def streaming_pipeline(vectorizer, train_path, test_path, model=None, cache_dir='../large_files/r8_features',
+                       chunk_size=10000, n_epochs=5):
+    # featurize both files to disk, then train and score chunk-wise
+    if model is None:
+        from sklearn.linear_model import SGDClassifier
+        model = SGDClassifier(alpha=1e-4, random_state=0)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    Xtrain, Ytrain, classes = featurize_tsv(train_path, vectorizer, os.path.join(cache_dir, 'train'), chunk_size=chunk_size)
+    Xtest, Ytest, classes = featurize_tsv(test_path, vectorizer, os.path.join(cache_dir, 'test'), classes, chunk_size)
+
+    train_incremental(model, Xtrain, Ytrain, classes, n_epochs, chunk_size)
+    print("train score: ", score_chunked(model, Xtrain, Ytrain, chunk_size))
+    print("test score: ", score_chunked(model, Xtest, Ytest, chunk_size))
+    return model
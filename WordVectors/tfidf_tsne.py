@@ -1,229 +1,91 @@
-
 from __future__ import print_function, division
 from builtins import range
 
-import os
-import string
 import sys
-import operator
-
-from sklearn.metrics.pairwise import pairwise_distances
-
-from nltk.corpus import brown
-
-
-
-
-def find_analogies(w1, w2, w3, We, word2idx, idx2word):
-    V, D = We.shape
-
-    king = We[word2idx[w1]]
-    man = We[word2idx[w2]]
-    woman = We[word2idx[w3]]
-    v0 = king - man - woman
-
-    for dist in ('euclidean', 'cosine'):
-        distances = pairwise_distances
-
-        idx = distances.argsort()[:4]
-        best_idx = -1
-        keep_out = [word2idx[w] for w in (w1, w2, w3)]
-        for i in idx:
-            if i not in keep_out:
-                best_idx = i
-                break
-        best_word = idx2word[best_idx]
-
-        print("closest match by", dist, "distance: ", best_word)
-        print(w1, "-", w2, "=",best_word, "-", w3)
-
-def remove_punctuation_2(s):
-    return s.translate(None, string.punctuation)
-
-
-def remove_punctuation_3(s):
-    return s.translate(str.maketrans('', '',string.punctuation))
-
-
-if sys.version.startswith('2'):
-    remove_punctuation = remove_punctuation_2
-else:
-    remove_punctuation = remove_punctuation_3
-
-
-def my_tokenizer(s):
-    s = remove_punctuation(s)
-    s = s.lower()
-    return s.split()
-
-
-def get_wikipedia_data(n_files, n_vocab, by_paragraph=False):
-    prefix = '../large_files'
-
-    if not os.path.exist(prefix):
-        print("Please download the data from https://dumps.wikimedia.org/")
-        exit()
-
-    input_files = [f for f in os.listdir(prefix) if f.startswith('enwiki') and f.endswith('txt')]
-
-    if len(input_files) == 0:
-        print("Please download the data from https://dumps.wikimedia.org/")
-        exit()
-
-    # return variables
-
-    sentences = []
-    word2idx = {'START' : 0, 'END': 1}
-    idx2word = ['START', 'END']
-    current_idx = 2
-    word_idx_count = {0: float('inf'), 1: float('inf')}
-
-    if n_files is not None:
-        input_files = input_files[:n_files]
-
-    for f in input_files:
-        print("reading", f)
-        for line in open(prefix + f):
-            line = line.strip()
-
-            if line and line[0] not in ('[', '*', '-', '|', '=', '{', '}'):
-                if by_paragraph:
-                    sentence_lines = [line]
-                else:
-                    sentence_lines = line.split('. ')
-                for sentence in sentence_lines:
-                    tokens = my_tokenizer(sentence)
-                    for t in tokens:
-                        if t not in word2idx:
-                            word2idx[t] = current_idx
-                            idx2word.append(t)
-                            current_idx += 1
-                        idx = word2idx[t]
-                        word_idx_count[idx] = word_idx_count.get(idx,0) + 1
-
-                    sentence_by_idx = [word2idx[t] for t in tokens]
-                    sentences.append(sentence_by_idx)
-
-    sorted_word_idx_count = sorted(word_idx_count.items(), key=operator.itemgetter(1), reverse=True)
-    word2idx_small = {}
-
-    new_idx = 0
-
-    idx_new_idx_map ={}
-    for idx, count in sorted_word_idx_count[:n_vocab]:
-        word = idx2word[idx]
-        print(word, count)
-        word2idx_small[word] = new_idx
-        idx_new_idx_map[idx] = new_idx
-        new_idx += 1
-
-    word2idx_small['UNKOWN'] = new_idx
-    unknown = new_idx
-
-    assert('START' in word2idx_small)
-    assert('END' in word2idx_small)
-    assert('king' in word2idx_small)
-    assert('queen' in word2idx_small)
-    assert('man' in word2idx_small)
-    assert('woman' in word2idx_small)
-
-    sentence_small = []
-    for sentence in sentences:
-        if len(sentence) > 1:
-            new_sentence = [idx_new_idx_map[idx] if idx in idx_new_idx_map else unknown for idx in sentence]
-            sentence_small.append(new_sentence)
-
-    return sentence_small, word2idx_small
-
-KEEP_WORDS = set([
-    'king', 'man', 'queen', 'woman',
-    'italy', 'rome', 'france', 'paris',
-    'london', 'britain', 'england',
-])
-
-def get_sentences():
-    # returns 57340 of the Brown corpus
-    # each sentence is represented as a list of individual string tokens
-    return brown.sents()
-
-
-def get_sentences_with_word2idx():
-    sentences = get_sentences()
-    indexed_sentences = []
-
-    i = 2
-    word2idx = {'START': 0, 'END': 1}
-    for sentence in sentences:
-        indexed_sentence = []
-        for token in sentence:
-            token = token.lower()
-            if token not in word2idx:
-                word2idx[token] = i
-                i +=1
-            indexed_sentence.append(word2idx[token])
-        indexed_sentences.append(indexed_sentence)
-    print("Vocab size: ", i)
-    return indexed_sentences, word2idx
-
-def get_sentences_with_word2idx_limit_vocab(n_vocab=2000, keep_words=KEEP_WORDS):
-    sentences = get_sentences()
-    indexed_sentences = []
-
-    i = 2
-    word2idx = {'START': 0, 'END': 1}
-    idx2word = ['START', 'END']
-
-    word_idx_count = {
-        0: float('inf'),
-        1: float('inf')
-    }
-
-    for sentence in sentences:
-        indexed_sentence = []
-        for token in sentence:
-            token = token.lower()
-            if token not in word2idx:
-                idx2word.append(token)
-                word2idx[token] = i
-                i += 1
-
-            idx = word2idx[token]
-            word_idx_count[idx] = word_idx_count.get(idx, 0) +1
-
-            indexed_sentence.append(idx)
-        indexed_sentences.append(indexed_sentence)
-
-    # restrict vocab size
-    for word in keep_words:
-        word_idx_count[word2idx[word]] = float('inf')
-
-    sorted_word_idx_count = sorted(word_idx_count.items(), key=operator.itemgetter(1), reverse=True)
-    word2idx_small = {}
-    new_idx = 0
-
-    idx_new_idx_map = {}
-    for idx, count in sorted_word_idx_count[:n_vocab]:
-        word = idx2word[idx]
-        print(word, count)
-        word2idx_small[word] = new_idx
-        idx_new_idx_map[idx] = new_idx
-        new_idx += 1
-
-    word2idx_small['UNKOWN'] = new_idx
-    unknown = new_idx
-
-    assert('START' in word2idx_small)
-    assert('END' in word2idx_small)
-    for word in keep_words:
-        assert(word in word2idx_small)
-
-    sentence_small = []
-    for sentence in indexed_sentences:
-        if len(sentence) > 1:
-            new_sentence = [idx_new_idx_map[idx] if idx in idx_new_idx_map else unknown for idx in sentence]
-            sentence_small.append(new_sentence)
-    return sentence_small, word2idx_small
-
-
-
-
+from datetime import datetime
+
+import numpy as np
+import matplotlib.pyplot as plt
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.decomposition import TruncatedSVD
+from sklearn.manifold import TSNE
+
+from nlp_util import get_wikipedia_data, find_analogies
+from similarity_index import SimilarityIndex
+
+# Word vectors from TF-IDF: every word is a row of the words x paragraphs
+# TF-IDF matrix. The matrix is sparse from the start (built straight from the
+# flat wiki corpus), reduced with randomized truncated SVD and only then
+# projected to 2D with Barnes-Hut t-SNE, which is O(V log V) per iteration
+# instead of the O(V^2) of exact t-SNE.
+
+
+def get_tfidf(corpus, V):
+    # corpus: FlatCorpus of paragraphs. idf is computed over the paragraphs,
+    # the result is transposed so that row i is word i
+    counts = corpus.count_matrix(V)
+    return TfidfTransformer().fit_transform(counts).T.tocsr()
+
+
+def drop_words(A, word2idx, words=('START', 'END', 'UNKOWN')):
+    # START and END never occur in a paragraph and UNKOWN stands for every
+    # out-of-vocabulary token, so none of them is a word to place or query.
+    # words that never occur have all-zero rows and are dropped as well.
+    # returns the remaining rows and their word2idx, in the same order
+    keep = np.flatnonzero(A.getnnz(axis=1) > 0)
+    keep = np.setdiff1d(keep, [word2idx[w] for w in words if w in word2idx])
+    idx2word = dict((i, w) for w, i in word2idx.items())
+    return A[keep], dict((idx2word[i], n) for n, i in enumerate(keep))
+
+
+def reduce_svd(A, n_components=100, seed=0):
+    n_components = min(n_components, min(A.shape) - 1)
+    svd = TruncatedSVD(n_components=n_components, algorithm='randomized', n_iter=5, random_state=seed)
+    return svd.fit_transform(A)
+
+
+def project_tsne(Z, seed=0):
+    # Barnes-Hut needs perplexity < n_samples / 3
+    perplexity = min(30.0, (len(Z) - 1) / 3)
+    tsne = TSNE(n_components=2, perplexity=perplexity, init='pca', method='barnes_hut', random_state=seed)
+    return tsne.fit_transform(Z)
+
+
+def main(n_files=3, n_vocab=2000, n_components=100, n_labels=200):
+    t0 = datetime.now()
+    corpus, word2idx = get_wikipedia_data(n_files, n_vocab, by_paragraph=True, streaming=True, flat=True)
+    print("read %d paragraphs, %d words in %s" % (len(corpus), len(word2idx), datetime.now() - t0))
+
+    t0 = datetime.now()
+    A, word2idx = drop_words(get_tfidf(corpus, len(word2idx)), word2idx)
+    idx2word = dict((i, w) for w, i in word2idx.items())
+    V = len(word2idx)
+    print("tf-idf: %d x %d, %d non-zeros in %s" % (A.shape[0], A.shape[1], A.nnz, datetime.now() - t0))
+
+    t0 = datetime.now()
+    Z = reduce_svd(A, n_components)
+    print("truncated SVD to %d dimensions in %s" % (Z.shape[1], datetime.now() - t0))
+
+    t0 = datetime.now()
+    Y = project_tsne(Z)
+    print("t-SNE of %d words in %s" % (V, datetime.now() - t0))
+
+    # analogies in the SVD space, the 2D map is only for looking at
+    index = SimilarityIndex(Z)
+    for w1, w2, w3 in (('king', 'man', 'woman'), ('france', 'paris', 'london'), ('man', 'woman', 'he')):
+        if all(w in word2idx for w in (w1, w2, w3)):
+            find_analogies(w1, w2, w3, Z, word2idx, idx2word, index)
+
+    # labelling every point of a 50k word map is unreadable, only the most
+    # frequent n_labels words get their text
+    plt.scatter(Y[:, 0], Y[:, 1], s=1)
+    for i in range(min(n_labels, V)):
+        plt.annotate(idx2word[i], xy=(Y[i, 0], Y[i, 1]))
+    plt.show()
+
+
+if __name__ == '__main__':
+    # usage: python tfidf_tsne.py [n files] [n vocab]
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    n_vocab = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    main(n_files, n_vocab)
@@ -0,0 +1,190 @@
+from __future__ import print_function, division
+from builtins import range
+
+import numpy as np
+
+
+# idx -> word as one utf-8 byte array plus int64 offsets, instead of a list
+# of python strings. It can be memory-mapped, so processes that load the same
+# file share its pages.
+class StringTable:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_words(cls, words):
+        encoded = [w.encode('utf-8') for w in words]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("word index out of range")
+        return self.data[self.offsets[i]:self.offsets[i+1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        blob = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for i in range(len(self)):
+            yield blob[offsets[i]:offsets[i+1]].decode('utf-8')
+
+    def tolist(self):
+        return list(self)
+
+
+# One vocabulary type for word2idx / idx2word / word_idx_count:
+#   word2idx: dict, idx2word: StringTable once frozen, counts: float64 array.
+# While it's being built words are kept in a plain list; freeze() packs them
+# and makes everything read-only. save()/load() use .npy files, so a worker
+# can np.load(mmap_mode='r') a shared vocabulary instead of re-reading text.
+class Vocab:
+    def __init__(self, words=(), counts=None):
+        self._word2idx = {}
+        self._idx2word = []
+        self._counts = np.zeros(16)
+        self.frozen = False
+        self.add_words(words)
+        if counts is not None:
+            self.counts[:] = counts
+
+    @classmethod
+    def from_word2idx(cls, word2idx):
+        return cls(sorted(word2idx, key=word2idx.get))
+
+    def __len__(self):
+        return len(self._idx2word)
+
+    def __contains__(self, word):
+        return word in self.word2idx
+
+    def __getitem__(self, word):
+        return self.word2idx[word]
+
+    def __iter__(self):
+        return iter(self._idx2word)
+
+    def get(self, word, default=None):
+        return self.word2idx.get(word, default)
+
+    def word(self, idx):
+        return self._idx2word[idx]
+
+    @property
+    def word2idx(self):
+        # a loaded vocabulary builds its dict on first lookup only, so a
+        # process that just maps ids back to words never pays for it
+        if self._word2idx is None:
+            self._word2idx = dict((w, i) for i, w in enumerate(self._idx2word))
+        return self._word2idx
+
+    @property
+    def idx2word(self):
+        return self._idx2word
+
+    @property
+    def counts(self):
+        return self._counts[:len(self)]
+
+    def add(self, word, count=0):
+        return self.add_words([word], [count] if count else None)[0]
+
+    def add_words(self, words, counts=None):
+        # returns the index of every word, new words are appended in first-seen order
+        if self.frozen:
+            raise ValueError("cannot add words to a frozen Vocab")
+        word2idx = self._word2idx
+        idx2word = self._idx2word
+        for w in words:
+            if w not in word2idx:
+                word2idx[w] = len(idx2word)
+                idx2word.append(w)
+        if len(idx2word) > len(self._counts):
+            # grow the counts array geometrically, like a list would
+            grown = np.zeros(max(len(idx2word), 2 * len(self._counts)))
+            grown[:len(self._counts)] = self._counts
+            self._counts = grown
+        idxs = [word2idx[w] for w in words]
+        if counts is not None:
+            np.add.at(self._counts, idxs, counts)
+        return idxs
+
+    def count_tokens(self, tokens):
+        # adds the occurrences of every id in tokens (e.g. FlatCorpus.tokens)
+        if self.frozen:
+            raise ValueError("cannot count into a frozen Vocab")
+        self._counts[:len(self)] += np.bincount(tokens, minlength=len(self))[:len(self)]
+
+    def pin(self, words):
+        # pinned words (START, END, keep_words...) always survive limit()
+        if self.frozen:
+            raise ValueError("cannot pin words of a frozen Vocab")
+        for w in words:
+            self._counts[self.word2idx[w]] = float('inf')
+
+    def most_common_idx(self, n=None):
+        # the n largest counts, in the order of a stable descending sort:
+        # ties (including at the cut-off) go to the lower index
+        counts = self.counts
+        if n is None or n >= len(counts):
+            top = np.arange(len(counts))
+        elif n <= 0:
+            top = np.arange(0)
+        else:
+            cutoff = counts[np.argpartition(-counts, n - 1)[n - 1]]
+            above = np.flatnonzero(counts > cutoff)
+            ties = np.flatnonzero(counts == cutoff)[:n - len(above)]
+            top = np.concatenate([above, ties])
+        return top[np.lexsort((top, -counts[top]))]
+
+    def limit(self, n, unknown_word='UNKOWN'):
+        # keeps the n most frequent words plus unknown_word at the end.
+        # also returns a dense old idx -> new idx lookup table for np.take,
+        # every word that didn't make the cut maps to unknown_word
+        top = self.most_common_idx(n)
+        idx2word = self._idx2word
+        small = Vocab([idx2word[i] for i in top], self.counts[top])
+        dropped = np.ones(len(self), dtype=bool)
+        dropped[top] = False
+        unknown = small.add(unknown_word, self.counts[dropped].sum())
+
+        idx_new_idx_map = np.full(len(self), unknown, dtype=np.int32)
+        idx_new_idx_map[top] = np.arange(len(top), dtype=np.int32)
+        return small, idx_new_idx_map
+
+    def freeze(self):
+        if not self.frozen:
+            self._idx2word = StringTable.from_words(self._idx2word)
+            self._counts = self._counts[:len(self)].copy()
+            self._counts.flags.writeable = False
+            self.frozen = True
+        return self
+
+    def save(self, prefix):
+        table = self._idx2word if self.frozen else StringTable.from_words(self._idx2word)
+        np.save(prefix + '_words.npy', table.data)
+        np.save(prefix + '_word_offsets.npy', table.offsets)
+        np.save(prefix + '_counts.npy', np.asarray(self.counts, dtype=np.float64))
+
+    @classmethod
+    def load(cls, prefix, mmap_mode='r'):
+        # always frozen: the arrays may be shared with other processes
+        vocab = cls()
+        vocab._idx2word = StringTable(
+            np.load(prefix + '_words.npy', mmap_mode=mmap_mode),
+            np.load(prefix + '_word_offsets.npy', mmap_mode=mmap_mode),
+        )
+        vocab._counts = np.load(prefix + '_counts.npy', mmap_mode=mmap_mode)
+        vocab._counts.flags.writeable = False
+        vocab._word2idx = None
+        vocab.frozen = True
+        return vocab
@@ -2,12 +2,34 @@ from __future__ import print_function , division
 from future.utils import iteritems
 from builtins import range
 
+import os
+import sys
 from gensim.models import KeyedVectors
 
-word_vectors = KeyedVectors.load_word2vec_format(
-    '../large_files/GoogleNews-vectors-negative300.bin',
-    binary=True
-)
+from analogy_eval import evaluate_analogies, ANALOGY_FILE
+from word2vec_bin import Word2VecBin, WORD2VEC_BIN
+
+# usage: python word2vec1.py [n words]
+# with n words, only the n most frequent rows are read from the .bin (through
+# its offset index) instead of all 3M
+if len(sys.argv) > 1:
+    words, vectors = Word2VecBin(WORD2VEC_BIN).load_top_n(int(sys.argv[1]))
+    word_vectors = KeyedVectors(vectors.shape[1])
+    try:
+        word_vectors.add_vectors(words, vectors)
+    except AttributeError:
+        # gensim < 4
+        word_vectors.add(words, vectors)
+else:
+    word_vectors = KeyedVectors.load_word2vec_format(
+        WORD2VEC_BIN,
+        binary=True
+    )
+try:
+    word2idx = word_vectors.key_to_index
+except AttributeError:
+    # gensim < 4
+    word2idx = dict((w, v.index) for w, v in iteritems(word_vectors.vocab))
 
 def find_analogies(w1, w2, w3):
     r = word_vectors.most_similar(positive=[w1, w3], negative=[w2])
@@ -53,3 +75,8 @@ nearest_neighbors('woman')
 nearest_neighbors('nephew')
 nearest_neighbors('february')
 nearest_neighbors('rome')
+
+# the whole benchmark, scored in blocked matrix products. GoogleNews is
+# case-sensitive and sorted by frequency, keep the 300k most frequent words
+if os.path.exists(ANALOGY_FILE):
+    evaluate_analogies(word_vectors.vectors, word2idx, ANALOGY_FILE, lowercase=False, restrict_vocab=300000)
@@ -0,0 +1,192 @@
+from __future__ import print_function, division
+from builtins import range
+
+import os
+import sys
+import mmap
+from datetime import datetime
+
+import numpy as np
+
+from vocab import StringTable
+
+# Row-level access to a word2vec binary file (e.g. GoogleNews-vectors-negative300.bin)
+# without loading it. The file is scanned once into an index:
+#   <prefix>_index_offsets.npy   byte offset of every vector
+#   <prefix>_index_words.npy / _index_word_offsets.npy   the words, as a StringTable of raw bytes
+#   <prefix>_index_sorted.npy    word order sorted by bytes, for binary search
+#   <prefix>_index_source.npy    size and mtime of the .bin the index was built from
+# After that the .bin is memory-mapped and only the rows that are looked up
+# are paged in. Words are kept in file order, i.e. most frequent first.
+
+WORD2VEC_BIN = '../large_files/GoogleNews-vectors-negative300.bin'
+
+
+def bin_fingerprint(bin_path):
+    st = os.stat(bin_path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def index_is_current(bin_path, prefix):
+    # a replaced or regenerated .bin has a new size or mtime, and its old
+    # index would point at the wrong bytes
+    if not os.path.exists(prefix + '_index_offsets.npy') or not os.path.exists(prefix + '_index_source.npy'):
+        return False
+    return np.array_equal(np.load(prefix + '_index_source.npy'), bin_fingerprint(bin_path))
+
+
+def build_bin_index(bin_path, prefix):
+    print("indexing", bin_path)
+    t0 = datetime.now()
+    source = bin_fingerprint(bin_path)
+    with open(bin_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = mm.find(b'\n')
+        V, D = map(int, mm[:header_end].split())
+        record = 4 * D
+
+        words = []
+        offsets = np.zeros(V, dtype=np.int64)
+        pos = header_end + 1
+        for i in range(V):
+            # records are "<word> <D float32>", usually followed by a newline
+            while mm[pos:pos+1] in (b'\n', b'\r'):
+                pos += 1
+            space = mm.find(b' ', pos)
+            words.append(mm[pos:space])
+            offsets[i] = space + 1
+            pos = space + 1 + record
+        mm.close()
+
+    table_offsets = np.zeros(V + 1, dtype=np.int64)
+    np.cumsum([len(w) for w in words], out=table_offsets[1:])
+    sorted_order = np.array(sorted(range(V), key=words.__getitem__), dtype=np.int64)
+
+    np.save(prefix + '_index_words.npy', np.frombuffer(b''.join(words), dtype=np.uint8))
+    np.save(prefix + '_index_word_offsets.npy', table_offsets)
+    np.save(prefix + '_index_sorted.npy', sorted_order)
+    np.save(prefix + '_index_source.npy', source)
+    # the vector offsets go last, their presence marks a complete index
+    np.save(prefix + '_index_offsets.npy', offsets)
+    print("indexed %d x %d in %s" % (V, D, datetime.now() - t0))
+
+
+class LazyRows:
+    # lets word2vec_bin.vectors[idxs] read rows like gensim's .vectors array
+    def __init__(self, bin_file):
+        self.bin_file = bin_file
+        self.shape = (bin_file.V, bin_file.D)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, idxs):
+        if np.isscalar(idxs):
+            return self.bin_file.read_rows([idxs])[0]
+        return self.bin_file.read_rows(np.arange(self.shape[0])[idxs] if isinstance(idxs, slice) else idxs)
+
+
+class Word2VecBin:
+    # limit: only the first `limit` words exist (like gensim's limit=)
+    # preload: read those rows into memory at once instead of on demand
+    def __init__(self, bin_path=WORD2VEC_BIN, limit=None, preload=False):
+        prefix = os.path.splitext(bin_path)[0]
+        if not index_is_current(bin_path, prefix):
+            build_bin_index(bin_path, prefix)
+
+        self.offsets = np.load(prefix + '_index_offsets.npy', mmap_mode='r')
+        self.words = StringTable(
+            np.load(prefix + '_index_words.npy', mmap_mode='r'),
+            np.load(prefix + '_index_word_offsets.npy', mmap_mode='r'),
+        )
+        self.sorted_order = np.load(prefix + '_index_sorted.npy', mmap_mode='r')
+
+        self._file = open(bin_path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = self._mm[:self._mm.find(b'\n')].split()
+        self.D = int(header[1])
+        self.V = len(self.offsets) if limit is None else min(limit, len(self.offsets))
+        self.vector_size = self.D
+
+        # word -> idx for the words actually looked up, so memory grows with
+        # the words used rather than with the 3M words of the file
+        self._lookups = {}
+        self.vectors = LazyRows(self)
+        self._preloaded = None
+        if preload:
+            self._preloaded = self.read_rows(np.arange(self.V))
+
+    def _word_bytes(self, i):
+        o = self.words.offsets
+        return self.words.data[o[i]:o[i+1]].tobytes()
+
+    def index_of(self, word):
+        # binary search over the sorted words, -1 when missing
+        idx = self._lookups.get(word)
+        if idx is None:
+            key = word.encode('utf-8')
+            lo, hi = 0, len(self.sorted_order)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._word_bytes(self.sorted_order[mid]) < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            idx = -1
+            if lo < len(self.sorted_order):
+                i = int(self.sorted_order[lo])
+                if i < self.V and self._word_bytes(i) == key:
+                    idx = i
+            self._lookups[word] = idx
+        return idx
+
+    def get(self, word, default=None):
+        # dict-like, so it can stand in for word2idx in batch_tokenize_ids
+        idx = self.index_of(word)
+        return default if idx < 0 else idx
+
+    def __contains__(self, word):
+        return self.index_of(word) >= 0
+
+    def __len__(self):
+        return self.V
+
+    def word(self, idx):
+        return self._word_bytes(idx).decode('utf-8', errors='replace')
+
+    def read_rows(self, idxs):
+        idxs = np.asarray(idxs, dtype=np.int64)
+        if self._preloaded is not None:
+            return self._preloaded[idxs]
+        out = np.zeros((len(idxs), self.D), dtype=np.float32)
+        for j, i in enumerate(idxs):
+            out[j] = np.frombuffer(self._mm, dtype='<f4', count=self.D, offset=int(self.offsets[i]))
+        return out
+
+    def get_vector(self, word):
+        idx = self.index_of(word)
+        if idx < 0:
+            raise KeyError("word '%s' not in vocabulary" % word)
+        return self.read_rows([idx])[0]
+
+    def load_top_n(self, n):
+        # the n most frequent words and their (n, D) float32 matrix
+        n = min(n, self.V)
+        return [self.word(i) for i in range(n)], self.read_rows(np.arange(n))
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+if __name__ == '__main__':
+    # usage: python word2vec_bin.py [bin file] word...
+    bin_path = sys.argv[1] if len(sys.argv) > 1 else WORD2VEC_BIN
+    t0 = datetime.now()
+    w2v = Word2VecBin(bin_path)
+    print("opened %d x %d in %s" % (w2v.V, w2v.D, datetime.now() - t0))
+    for word in sys.argv[2:] or ['king', 'queen', 'France']:
+        if word in w2v:
+            print(word, w2v.index_of(word), w2v.get_vector(word)[:5])
+        else:
+            print(word, "not in vocabulary")
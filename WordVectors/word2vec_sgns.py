@@ -0,0 +1,171 @@
+from __future__ import print_function, division
+from builtins import range
+
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from vocab import Vocab
+from similarity_index import SimilarityIndex
+from nlp_util import find_analogies, get_wikipedia_data, get_sentences_with_word2idx_limit_vocab
+
+# Skip-gram with negative sampling (Mikolov et al. 2013) in NumPy, trained on
+# the FlatCorpus from get_wikipedia_data / get_sentences_with_word2idx_limit_vocab.
+#
+# Nothing is done per token in python: for every chunk of sentences the
+# subsampling mask, the dynamic-window (center, context) pairs and the
+# negatives are drawn as arrays, then the pairs are shuffled and trained in
+# minibatches with one gather / einsum / np.add.at per parameter matrix.
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def unigram_table(counts, power=0.75, table_size=10000000):
+    # word i fills a share of the table proportional to count_i ** power, so
+    # a uniform index into it draws negatives from the smoothed unigram
+    p = np.asarray(counts, dtype=np.float64) ** power
+    p /= p.sum()
+    return np.repeat(np.arange(len(p), dtype=np.int32), np.round(p * table_size).astype(np.int64))
+
+
+def keep_probabilities(counts, sample=1e-3):
+    # word2vec's subsampling: a word with frequency f is kept with
+    # probability (sqrt(f / sample) + 1) * sample / f, capped at 1
+    counts = np.asarray(counts, dtype=np.float64)
+    f = counts / counts.sum()
+    keep = np.ones(len(counts))
+    nonzero = f > 0
+    keep[nonzero] = (np.sqrt(f[nonzero] / sample) + 1) * sample / f[nonzero]
+    return np.minimum(keep, 1)
+
+
+def make_pairs(corpus, keep_prob, window, rng):
+    # (center, context) int32 arrays for one chunk of sentences. subsampled
+    # words are removed before the windows are taken, like word2vec.c, and
+    # every center uses a window size drawn from 1..window
+    tokens = np.asarray(corpus.tokens)
+    sentence = np.repeat(np.arange(len(corpus)), corpus.lengths())
+    keep = rng.random_sample(len(tokens)) < keep_prob[tokens]
+    tokens, sentence = tokens[keep], sentence[keep]
+
+    spans = rng.randint(1, window + 1, size=len(tokens))
+    centers = []
+    contexts = []
+    for d in range(1, window + 1):
+        same = sentence[d:] == sentence[:-d]
+        # left word as center, right word as context, and the reverse
+        left = same & (spans[:-d] >= d)
+        right = same & (spans[d:] >= d)
+        centers.extend([tokens[:-d][left], tokens[d:][right]])
+        contexts.extend([tokens[d:][left], tokens[:-d][right]])
+    return np.concatenate(centers).astype(np.int32), np.concatenate(contexts).astype(np.int32)
+
+
+class SGNS:
+    def __init__(self, V, D=100, seed=0):
+        rng = np.random.RandomState(seed)
+        self.V, self.D = V, D
+        self.W = ((rng.random_sample((V, D)) - 0.5) / D).astype(np.float32)   # input (center) vectors
+        self.U = np.zeros((V, D), dtype=np.float32)                            # output (context) vectors
+
+    def train_batch(self, centers, contexts, negatives, lr):
+        # one SGD step on B (center, context) pairs with K negatives each.
+        # returns the summed loss -log s(v.u_o) - sum log s(-v.u_n)
+        v = self.W[centers]                 # (B, D)
+        u_pos = self.U[contexts]            # (B, D)
+        u_neg = self.U[negatives]           # (B, K, D)
+
+        s_pos = sigmoid((v * u_pos).sum(axis=1))
+        s_neg = sigmoid(np.einsum('bkd,bd->bk', u_neg, v))
+        loss = -np.log(s_pos + 1e-10).sum() - np.log(1 - s_neg + 1e-10).sum()
+
+        g_pos = (s_pos - 1)[:, None]        # d loss / d (v.u_pos)
+        g_neg = s_neg[:, :, None]           # d loss / d (v.u_neg)
+        grad_v = g_pos * u_pos + (g_neg * u_neg).sum(axis=1)
+
+        # np.add.at sums the updates of words that occur more than once
+        np.add.at(self.U, contexts, -lr * g_pos * v)
+        np.add.at(self.U, negatives.ravel(), (-lr * g_neg * v[:, None, :]).reshape(-1, self.D))
+        np.add.at(self.W, centers, -lr * grad_v)
+        return loss
+
+    def fit(self, corpus, counts, epochs=1, window=5, n_negative=5, sample=1e-3, lr=0.025,
+            batch_size=1024, chunk_tokens=1000000, seed=0, print_every=1000, ignore=()):
+        # ignore: word ids never trained on nor drawn as negatives (UNKOWN)
+        rng = np.random.RandomState(seed)
+        counts = np.array(counts, dtype=np.float64)
+        counts[list(ignore)] = 0
+        table = unigram_table(counts)
+        keep_prob = keep_probabilities(counts, sample)
+        keep_prob[list(ignore)] = 0
+        n_tokens = corpus.n_tokens()
+        chunk_sentences = max(1, int(len(corpus) * chunk_tokens / max(n_tokens, 1)))
+        total = epochs * n_tokens
+        done = 0
+        losses = []
+
+        for epoch in range(epochs):
+            t0 = datetime.now()
+            epoch_loss = 0
+            n_pairs = 0
+            for start in range(0, len(corpus), chunk_sentences):
+                chunk = corpus[start:start+chunk_sentences]
+                centers, contexts = make_pairs(chunk, keep_prob, window, rng)
+                order = rng.permutation(len(centers))
+                centers, contexts = centers[order], contexts[order]
+                negatives = table[rng.randint(len(table), size=(len(centers), n_negative))]
+
+                for b, i in enumerate(range(0, len(centers), batch_size)):
+                    # learning rate decays linearly with the words seen
+                    progress = (done + chunk.n_tokens() * i / max(len(centers), 1)) / total
+                    alpha = max(lr * (1 - progress), lr * 1e-4)
+                    epoch_loss += self.train_batch(
+                        centers[i:i+batch_size], contexts[i:i+batch_size], negatives[i:i+batch_size], alpha)
+                    if print_every and b % print_every == 0 and b > 0:
+                        elapsed = (datetime.now() - t0).total_seconds()
+                        words = done - epoch * n_tokens + chunk.n_tokens() * i / len(centers)
+                        print("epoch %d: %.1f%%, lr %.5f, %.0f words/s" % (
+                            epoch, 100 * progress, alpha, words / max(elapsed, 1e-9)))
+                n_pairs += len(centers)
+                done += chunk.n_tokens()
+
+            elapsed = (datetime.now() - t0).total_seconds()
+            losses.append(epoch_loss / max(n_pairs, 1))
+            print("epoch %d: loss %.4f, %d pairs, %.0f words/s, %.0f pairs/s, %s" % (
+                epoch, losses[-1], n_pairs, n_tokens / elapsed, n_pairs / elapsed, datetime.now() - t0))
+        return losses
+
+    def save(self, prefix, vocab):
+        # the embedding_store layout, load it back with load_embeddings(prefix)
+        np.save(prefix + '_vectors.npy', self.W)
+        vocab.save(prefix)
+
+
+if __name__ == '__main__':
+    # usage: python word2vec_sgns.py [brown|wiki] [epochs] [n vocab]
+    source = sys.argv[1] if len(sys.argv) > 1 else 'brown'
+    epochs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    n_vocab = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+
+    if source == 'wiki':
+        corpus, word2idx = get_wikipedia_data(None, n_vocab, streaming=True, flat=True, use_cache=True)
+    else:
+        corpus, word2idx = get_sentences_with_word2idx_limit_vocab(n_vocab, flat=True, use_cache=True)
+    V = len(word2idx)
+    counts = np.bincount(np.asarray(corpus.tokens), minlength=V)
+    print("%d sentences, %d tokens, %d words" % (len(corpus), corpus.n_tokens(), V))
+
+    model = SGNS(V, D=100)
+    model.fit(corpus, counts, epochs=epochs, ignore=[word2idx[w] for w in ('UNKOWN',) if w in word2idx])
+
+    vocab = Vocab(sorted(word2idx, key=word2idx.get), counts)
+    model.save('../large_files/sgns_%s' % source, vocab)
+
+    idx2word = vocab.idx2word
+    index = SimilarityIndex(model.W)
+    for w1, w2, w3 in (('king', 'man', 'woman'), ('france', 'paris', 'london'), ('man', 'woman', 'he')):
+        if all(w in word2idx for w in (w1, w2, w3)):
+            find_analogies(w1, w2, w3, model.W, word2idx, idx2word, index)